@@ -0,0 +1,94 @@
+#!/usr/bin/env python2
+# gammarf rtl_power parser benchmark v0.1
+#
+# Joshua Davis (gammarf -*- covert.codes)
+# http://gammarf.io
+# Copyright(C) 2016
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+# Compare the old per-bin rtl_power line parsing with parse_rtl_power_line
+# over a recorded capture, eg.
+#   rtl_power -f 115M:260M:5k -i 5 -c 15% capture.csv
+#   python2 benchmarks/bench_rtl_power_parse.py capture.csv
+
+from __future__ import division
+
+import os
+import sys
+import time
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'modules'))
+from gammarf_scanner import parse_rtl_power_line
+
+ERR = 1
+REPEAT = 5
+
+
+def legacy_parse(raw):
+    _, _, freq_low, freq_high, step, _samples, raw_readings = raw.split(', ', 6)
+    freq_low = float(freq_low)
+    step = float(step)
+
+    readings = [x.strip() for x in raw_readings.split(',')]
+    out = list()
+    for i in range(len(readings)):
+        freq = int(round(freq_low + (step * i)))
+        pwr = float(readings[i])
+        out.append( (freq, pwr) )
+    return out
+
+
+def vector_parse(raw):
+    return parse_rtl_power_line(raw)
+
+
+def timeit(func, lines):
+    best = None
+    for _ in range(REPEAT):
+        started = time.time()
+        for line in lines:
+            func(line)
+        elapsed = time.time() - started
+        if best is None or elapsed < best:
+            best = elapsed
+    return best
+
+
+def main():
+    if len(sys.argv) != 2:
+        print("Usage: {} rtl_power_capture.csv".format(sys.argv[0]))
+        exit(ERR)
+
+    with open(sys.argv[1]) as f:
+        lines = [l.rstrip('\n') for l in f if len(l.split(' ')[0].split('-')) == 3]
+
+    if not lines:
+        print("No rtl_power lines in {}".format(sys.argv[1]))
+        exit(ERR)
+
+    bins = sum(len(parse_rtl_power_line(l)[1]) for l in lines)
+    print("{} lines, {} bins (best of {})".format(len(lines), bins, REPEAT))
+
+    results = list()
+    for name, func in [('legacy', legacy_parse), ('vector', vector_parse)]:
+        elapsed = timeit(func, lines)
+        results.append(elapsed)
+        print("{:>8}: {:.3f} s, {:.0f} lines/sec, {:.0f} bins/sec".format(name, elapsed, len(lines) / elapsed, bins / elapsed))
+
+    print("speedup: {:.1f}x".format(results[0] / results[1]))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,160 @@
+#!/usr/bin/env python2
+# gammarf scanner replay v0.1
+#
+# Joshua Davis (gammarf -*- covert.codes)
+# http://gammarf.io
+# Copyright(C) 2016
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+# Play recorded rtl_power CSV or waterfall (.wf, .wf.gz) files through the
+# scanner's Reporter, with hits sent to a local UDP sink instead of the
+# server.  No hardware needed; the same input can be replayed to tune
+# hit_db, AVG_SAMPLES and the reporter itself, eg.
+#   python2 benchmarks/replay_scanner.py --hit-db 6 --avg-samples 50 capture.csv
+#   python2 benchmarks/replay_scanner.py --speed 1 waterfalls/*.wf.gz
+
+from __future__ import division
+
+import argparse
+import json
+import numpy
+import os
+import socket
+import sys
+import threading
+import time
+from multiprocessing import Pipe
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'modules'))
+import gammarf_scanner
+from gammarf_scanner import DEFAULT_HIT_BURST, DEFAULT_HIT_DB, AVG_SAMPLES, REPORTER_POLL, ReplayScanner, Reporter
+
+DRAIN_QUIET = 1  # s without a hit before the reporter's hit queue counts as empty
+LOC = {'lat': "0.1", 'lng': "0.1"}
+REPLAY_HIT_RATE = 1e6  # hits/sec; effectively unlimited unless asked for
+SINK_TIMEOUT = 0.2
+
+
+class StaticLocation(object):
+    def get_current(self):
+        return LOC
+
+
+class HitSink(threading.Thread):
+    """Stands in for the server: counts hits and their end-to-end latency"""
+    def __init__(self):
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.sock.bind(('127.0.0.1', 0))
+        self.sock.settimeout(SINK_TIMEOUT)
+        self.port = self.sock.getsockname()[1]
+        self.latencies = list()  # ms, from the row leaving the scanner to its hit arriving here
+        self.last = 0
+        self.stoprequest = threading.Event()
+
+        threading.Thread.__init__(self)
+        self.daemon = True
+
+    def run(self):
+        while not self.stoprequest.isSet():
+            try:
+                data = self.sock.recv(65536)
+            except socket.timeout:
+                continue
+
+            now = time.time()
+            hit = json.loads(data)
+            self.latencies.append(now * 1000 - int(hit['ct']))
+            self.last = now
+
+        self.sock.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay recorded sweeps through the scanner reporter")
+    parser.add_argument('files', nargs='+', help="rtl_power CSV or waterfall files, played in order")
+    parser.add_argument('--speed', type=float, default=0, help="playback rate, 1 is real time (default: as fast as possible)")
+    parser.add_argument('--hit-db', type=float, default=DEFAULT_HIT_DB)
+    parser.add_argument('--avg-samples', type=int, default=AVG_SAMPLES)
+    parser.add_argument('--hit-rate', type=float, default=REPLAY_HIT_RATE)
+    parser.add_argument('--hit-burst', type=int, default=DEFAULT_HIT_BURST)
+    args = parser.parse_args()
+
+    gammarf_scanner.AVG_SAMPLES = args.avg_samples  # the reporter is forked, so it sees this
+
+    sink = HitSink()
+    sink.start()
+
+    reporter_opts = {'station_id': 'replay',
+            'station_pass': '',
+            'server_host': '127.0.0.1',
+            'server_port': sink.port,
+            'agf': None,
+            'shards': 1,
+            'baseline_dir': None}
+
+    settings = {'print_all': False,
+            'print_hits': False,
+            'hit_db': args.hit_db,
+            'alert_on': False,
+            'alert_center': 0.0,
+            'alert_bw': 5000.0,
+            'hit_burst': args.hit_burst,
+            'hit_rate': args.hit_rate,
+            'stats': False}
+
+    reporter_pipe, child_pipe = Pipe()
+    reporter = Reporter(reporter_opts, child_pipe, settings)
+    reporter.start()
+
+    scanner_opts = {'devnum': 0,
+            'gain': 0.0,
+            'uuid': 'replay',
+            'baseline_key': 'replay',
+            'recorder': None,
+            'replay': args.files,
+            'speed': args.speed}
+
+    scanner = ReplayScanner(scanner_opts, reporter, reporter_pipe, StaticLocation(), None)
+    started = time.time()
+    scanner.start()
+    while scanner.is_alive():  # playback done
+        time.sleep(REPORTER_POLL)
+
+    while not scanner.ring.empty():
+        time.sleep(REPORTER_POLL)
+    processed = time.time()
+    dropped = scanner.ring.overflows()
+
+    while time.time() - max(sink.last, processed) < DRAIN_QUIET:  # let queued hits out
+        time.sleep(REPORTER_POLL)
+
+    scanner.detach()
+    reporter_pipe.send( ("stop", (None) ) )
+    reporter.join()
+    sink.stoprequest.set()
+    sink.join()
+
+    elapsed = processed - started
+    print("{} rows, {} bins in {:.2f} s: {:.0f} bins/sec".format(scanner.rows, scanner.bins, elapsed, scanner.bins / elapsed))
+    print("rows dropped (ring full): {}".format(dropped))
+    print("hits: {} (hit_db {}, avg_samples {})".format(len(sink.latencies), args.hit_db, args.avg_samples))
+    if sink.latencies:
+        latencies = numpy.array(sink.latencies)
+        print("latency ms: median {:.1f}, p99 {:.1f}, max {:.1f}".format(
+            numpy.median(latencies), numpy.percentile(latencies, 99), latencies.max()))
+
+
+if __name__ == '__main__':
+    main()
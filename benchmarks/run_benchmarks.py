@@ -0,0 +1,272 @@
+#!/usr/bin/env python2
+# gammarf data path benchmarks v0.1
+#
+# Joshua Davis (gammarf -*- covert.codes)
+# http://gammarf.io
+# Copyright(C) 2016
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+# Time the scanner, freqwatch and adsb hot paths on synthetic input (see
+# synthetic.py) and print one JSON document, eg.
+#   python2 benchmarks/run_benchmarks.py > before.json
+#   python2 benchmarks/run_benchmarks.py --stage scanner.process_row
+#
+# Per stage: items processed (bins, frequencies, messages), best wall time
+# over --repeat runs, items/sec, and memory: the net growth in gc-tracked
+# objects over one run (leaks, caches) and the process' peak RSS after it.
+
+from __future__ import division
+
+import argparse
+import gc
+import json
+import os
+import platform
+import resource
+import socket
+import sys
+import time
+from collections import OrderedDict
+from multiprocessing import Pipe
+
+import numpy
+import pyModeS as pms
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'modules'))
+import synthetic
+from gammarf_adsb import AdsbDecoder, parse_frame
+from gammarf_dsp import BinPowerEstimator, bytes_to_iq, next_2_to_pow, psd
+from gammarf_scanner import AVG_SAMPLES, DEFAULT_HIT_BURST, DEFAULT_HIT_DB, DEFAULT_HIT_RATE, Reporter, parse_rtl_power_line
+
+FREQWATCH_DWELL = 0.1  # s, as gammarf_freqwatch
+FREQWATCH_NFFT = 1024
+FREQWATCH_OFFSET = 200e3
+FREQWATCH_RATE = 2.4e6
+LOC = {'lat': "0.1", 'lng': "0.1"}
+REPEAT = 3
+
+
+def scanner_reporter():
+    """A Reporter that's never started, sending to a socket nobody reads"""
+    sink = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sink.bind(('127.0.0.1', 0))
+
+    reporter_opts = {'station_id': 'bench',
+            'station_pass': '',
+            'server_host': '127.0.0.1',
+            'server_port': sink.getsockname()[1],
+            'agf': None,
+            'shards': 1,
+            'baseline_dir': None}
+
+    settings = {'print_all': False,
+            'print_hits': False,
+            'hit_db': DEFAULT_HIT_DB,
+            'alert_on': False,
+            'alert_center': 0.0,
+            'alert_bw': 5000.0,
+            'hit_burst': DEFAULT_HIT_BURST,
+            'hit_rate': DEFAULT_HIT_RATE,
+            'stats': False}
+
+    _, child_pipe = Pipe()
+    return Reporter(reporter_opts, child_pipe, settings), sink
+
+
+def stage_scanner_parse(args):
+    lines = synthetic.rtl_power_lines(args.sweeps)
+    bins = sum(len(parse_rtl_power_line(line)[1]) for line in lines)
+
+    def run():
+        for line in lines:
+            parse_rtl_power_line(line)
+
+    return run, bins, 'bins'
+
+
+def stage_scanner_process_row(args):
+    rows = [parse_rtl_power_line(line) for line in synthetic.rtl_power_lines(args.sweeps)]
+    rows = [(header[2], header[4], pwrs) for header, pwrs in rows]
+    reporter, _ = scanner_reporter()
+
+    warmup = len(rows) // args.sweeps * (AVG_SAMPLES + 1)  # baselines full, so hits are looked for
+    for freq_low, step, pwrs in (rows * (warmup // len(rows) + 1))[:warmup]:
+        reporter.process_row(freq_low, step, pwrs, 0.0, LOC, 'bench', 0)
+
+    def run():
+        for freq_low, step, pwrs in rows:
+            reporter.process_row(freq_low, step, pwrs, 0.0, LOC, 'bench', 0)
+        reporter.hits.clear()
+
+    return run, sum(len(pwrs) for _, _, pwrs in rows), 'bins'
+
+
+def stage_scanner_send_hit(args):
+    reporter, sink = scanner_reporter()
+    hit = (100000000, -20.5, "48.750", 5000.0, 20000.0, 19.5, 8.7, LOC, 'bench', 0)
+
+    def run():
+        for _ in range(args.hits):
+            reporter.send_hit(*hit)
+
+    run.sink = sink  # keep it bound for the run
+    return run, args.hits, 'hits'
+
+
+def freqwatch_samples():
+    return synthetic.iq_buffer(next_2_to_pow(int(FREQWATCH_DWELL * FREQWATCH_RATE)), FREQWATCH_RATE, FREQWATCH_OFFSET)
+
+
+def stage_freqwatch_power(args):
+    samples = freqwatch_samples()
+    estimator = BinPowerEstimator(FREQWATCH_NFFT, FREQWATCH_RATE, [FREQWATCH_OFFSET])
+
+    def run():
+        for _ in range(args.freqs):
+            estimator.power(samples)
+
+    return run, args.freqs, 'freqs'
+
+
+def stage_freqwatch_convert(args):
+    """8 bit I/Q as read from the dongle to complex64, into a reused buffer"""
+    raw = numpy.random.RandomState(synthetic.SEED).randint(0, 256, 2 * len(freqwatch_samples())).astype(numpy.uint8)
+    samples = numpy.empty(len(raw) // 2, dtype=numpy.complex64)
+
+    def run():
+        for _ in range(args.freqs):
+            bytes_to_iq(raw, samples)
+
+    return run, args.freqs, 'freqs'
+
+
+def stage_freqwatch_psd(args):
+    """The full spectrum freqwatch used to compute, for comparison"""
+    samples = freqwatch_samples()
+
+    def run():
+        for _ in range(args.freqs):
+            psd(samples, FREQWATCH_NFFT, FREQWATCH_RATE / 1e6, numpy.hamming(FREQWATCH_NFFT))
+
+    return run, args.freqs, 'freqs'
+
+
+def adsb_lines(args):
+    if args.frames:
+        with open(args.frames) as f:
+            return [line.strip() for line in f if line.strip()]
+    return synthetic.modes_lines(args.messages)
+
+
+def stage_adsb_parse(args):
+    """Parity, downlink format, type code, address and cpr flag of each frame"""
+    frames = [line[1:-1] for line in adsb_lines(args)]
+
+    def run():
+        for msg in frames:
+            parse_frame(msg)
+
+    return run, len(frames), 'messages'
+
+
+def stage_adsb_parse_pms(args):
+    """The same fields through pyModeS, as the adsb module used to get them"""
+    frames = [line[1:-1] for line in adsb_lines(args)]
+
+    def run():
+        for msg in frames:
+            if pms.util.crc(msg, encode=True) != pms.util.hex2bin(msg[-6:]) or pms.df(msg) != 17:
+                continue
+            pms.adsb.typecode(msg)
+            pms.adsb.icao(msg)
+            pms.util.hex2bin(msg)[53] == '1'
+
+    return run, len(frames), 'messages'
+
+
+def stage_adsb_decode(args):
+    lines = adsb_lines(args)
+
+    def run():
+        decoder = AdsbDecoder({'print_all': False, 'local_cpr': False})
+        now = time.time()
+        for i, line in enumerate(lines):
+            decoder.decode(line, now + i * 1e-3)
+
+    return run, len(lines), 'messages'
+
+
+STAGES = OrderedDict([('scanner.parse', stage_scanner_parse),
+        ('scanner.process_row', stage_scanner_process_row),
+        ('scanner.send_hit', stage_scanner_send_hit),
+        ('freqwatch.power', stage_freqwatch_power),
+        ('freqwatch.psd', stage_freqwatch_psd),
+        ('freqwatch.convert', stage_freqwatch_convert),
+        ('adsb.parse', stage_adsb_parse),
+        ('adsb.parse_pms', stage_adsb_parse_pms),
+        ('adsb.decode', stage_adsb_decode)])
+
+
+def measure(name, setup, args):
+    run, items, unit = setup(args)
+
+    best = None
+    objects = None
+    for _ in range(args.repeat):
+        gc.collect()
+        before = len(gc.get_objects())
+        started = time.time()
+        run()
+        elapsed = time.time() - started
+        gc.collect()
+        objects = len(gc.get_objects()) - before
+
+        if best is None or elapsed < best:
+            best = elapsed
+
+    result = OrderedDict()
+    result['stage'] = name
+    result['items'] = items
+    result['unit'] = unit
+    result['seconds'] = round(best, 6)
+    result['per_sec'] = round(items / best, 1)
+    result['usec_per_item'] = round(best / items * 1e6, 3)
+    result['gc_objects_delta'] = objects
+    result['peak_rss_kb'] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the gammarf data paths, JSON to stdout")
+    parser.add_argument('--stage', action='append', choices=STAGES.keys(), help="run only these stages")
+    parser.add_argument('--repeat', type=int, default=REPEAT)
+    parser.add_argument('--sweeps', type=int, default=20, help="rtl_power sweeps for the scanner stages")
+    parser.add_argument('--hits', type=int, default=20000)
+    parser.add_argument('--freqs', type=int, default=50, help="freqwatch frequencies, one dwell's worth of IQ each")
+    parser.add_argument('--messages', type=int, default=2000, help="synthetic rtl_adsb lines")
+    parser.add_argument('--frames', help="recorded rtl_adsb output ('*hex;' lines) instead of synthetic frames")
+    args = parser.parse_args()
+
+    report = OrderedDict()
+    report['python'] = platform.python_version()
+    report['numpy'] = numpy.__version__
+    report['machine'] = platform.machine()
+    report['stages'] = [measure(name, STAGES[name], args) for name in (args.stage or STAGES.keys())]
+
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,81 @@
+#!/usr/bin/env python2
+# gammarf synthetic benchmark inputs v0.1
+#
+# Joshua Davis (gammarf -*- covert.codes)
+# http://gammarf.io
+# Copyright(C) 2016
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+# Deterministic stand-ins for what the hardware would produce: rtl_power
+# CSV lines, IQ buffers as read from a dongle, and rtl_adsb output.
+
+from __future__ import division
+
+import numpy
+import pyModeS as pms
+import time
+
+NOISE_DB = -40.0
+SEED = 1
+
+# real DF17 frames: identification, even/odd airborne position, velocity
+MODES_FRAMES = ['8D406B902015A678D4D220AA4BDA',
+        '8D40621D58C382D690C8AC2863A7',
+        '8D40621D58C386435CC412692AD6',
+        '8D485020994409940838175B284F']
+
+
+def rtl_power_lines(sweeps, segments=8, nbins=1024, step=5000, low=100e6, hits=4):
+    """rtl_power CSV lines, 'segments' lines per sweep, a few bins hot from halfway"""
+    rng = numpy.random.RandomState(SEED)
+    started = time.time()
+    seg_width = nbins * step
+
+    lines = list()
+    for sweep in range(sweeps):
+        stamp = time.localtime(started + sweep)
+        date, hms = time.strftime("%Y-%m-%d", stamp), time.strftime("%H:%M:%S", stamp)
+        for seg in range(segments):
+            freq_low = low + seg * seg_width
+            pwrs = NOISE_DB + rng.normal(0, 1, nbins)
+            if sweep >= sweeps // 2:
+                pwrs[rng.randint(0, nbins, hits)] += 20
+            lines.append("{}, {}, {}, {}, {:.2f}, 10, {}".format(date, hms, int(freq_low), int(freq_low + seg_width),
+                step, ", ".join("{:.2f}".format(p) for p in pwrs)))
+
+    return lines
+
+
+def iq_buffer(numsamps, rate=2.4e6, tone=200e3, snr_db=20):
+    """complex128 samples (what pyrtlsdr's read_samples returns): a tone in noise"""
+    rng = numpy.random.RandomState(SEED)
+    t = numpy.arange(numsamps) / rate
+    noise = (rng.normal(0, 1, numsamps) + 1j * rng.normal(0, 1, numsamps)) * 10 ** (-snr_db / 20)
+    return numpy.exp(2j * numpy.pi * tone * t) + noise
+
+
+def with_icao(frame, icao):
+    """Re-address a DF17 frame and recompute its parity"""
+    frame = frame[:2] + icao + frame[8:22] + '000000'
+    return frame[:22] + "{:06X}".format(int(pms.util.crc(frame, encode=True), 2))
+
+
+def modes_lines(count, aircraft=64):
+    """rtl_adsb output lines cycling through MODES_FRAMES for 'aircraft' addresses"""
+    rng = numpy.random.RandomState(SEED)
+    icaos = ["{:06X}".format(a) for a in rng.randint(0, 1 << 24, aircraft)]
+
+    frames = [with_icao(frame, icao) for icao in icaos for frame in MODES_FRAMES]
+    return ["*{};".format(frames[i % len(frames)]) for i in range(count)]
@@ -31,6 +31,7 @@ CONF_FILE      = 'gammarf.conf'
 ERR            = 1
 PSEUDO_DEVNUM_BASE = 9000
 REQD_MODULES   = ['devices', 'location']
+SHARING_MODULES = ['capture', 'timeshare']  # may be run again on a device they occupy, to add jobs
 VERSION_STRING = "GammaRF v0.1, Copyright 2016 (gammarf |at| covert.codes)"
 
 MODPATH        = 'modules'
@@ -203,6 +204,15 @@ class Interpreter(cmd.Cmd):
         if module in REQD_MODULES:
             return
 
+        if len(parsed) > 1 and parsed[1] == 'auto':  # module picks its own devices
+            if not hasattr(self.loadedmods[module], 'run_auto'):
+                print("Module {} can't pick devices automatically".format(module))
+                return
+
+            cmdline = parsed[2] if len(parsed) > 2 and parsed[2] != '' else None
+            self.loadedmods[module].run_auto(cmdline, self.system_params, self.loadedmods)
+            return
+
         try:
             devnum = int(parsed[1])
         except:
@@ -229,7 +239,8 @@ class Interpreter(cmd.Cmd):
                 print("Not a device: {}".format(devnum))
                 return
 
-        if not self.loadedmods['devices'].occupied(devnum) or (module == 'remotetask' and (cmdline and cmdline.split(' ', 1)[0] == 'request') ):
+        attach = module in SHARING_MODULES and self.loadedmods['devices'].devnum_to_module(devnum) == module
+        if not self.loadedmods['devices'].occupied(devnum) or attach or (module == 'remotetask' and (cmdline and cmdline.split(' ', 1)[0] == 'request') ):
 
             if self.loadedmods[module].run(devnum, cmdline, self.system_params, self.loadedmods):
                 self.loadedmods['devices'].occupy(devnum, module, cmdline, pseudo)
@@ -23,20 +23,32 @@ from __future__ import division
 
 import abc
 import json
+import math
 import os
 import socket
 import threading
 import time
 import pyModeS as pms
+from binascii import unhexlify
 from collections import OrderedDict
 from hashlib import md5
 from subprocess import Popen, PIPE
 from sys import builtin_module_names
 
 from gammarf_base import GrfModuleBase
-
+from gammarf_procio import get_reader
+
+AIRCRAFT_TTL = 300  # s without a message before an aircraft is forgotten
+CPR_MAX = 1 << 17
+CPR_NZ = 15
+CPR_PAIR_MAX = 10  # s, odd and even frames further apart than this don't pair
+CRC24_POLY = 0xFFF409  # mode s parity generator, less its top bit
+EARTH_RADIUS_NM = 3440.065
 ERROR_SLEEP = 3
+FIX_MAX_AGE = 60  # s; a fix this recent is the reference for the aircraft's next frame
+MAX_AIRCRAFT = 4096  # least recently heard are evicted beyond this
 MODULE_DESCRIPTION = "adsb module"
+STATION_REF_RANGE = 150  # nm; single frames decoded against the station must land within this
 THREAD_TIMEOUT = 3
 
 
@@ -44,7 +56,295 @@ def start(config):
     return GrfModuleAdsb(config)
 
 
+def _crc24_table():
+    table = list()
+    for byte in range(256):
+        crc = byte << 16
+        for _ in range(8):
+            crc = (crc << 1) ^ CRC24_POLY if crc & 0x800000 else crc << 1
+        table.append(crc & 0xFFFFFF)
+    return table
+
+_crc24 = _crc24_table()
+
+
+def crc24(data):
+    """Mode S parity of a bytearray, a byte at a time"""
+    crc = 0
+    for byte in data:
+        crc = ((crc << 8) & 0xFFFFFF) ^ _crc24[(crc >> 16) ^ byte]
+    return crc
+
+
+def parse_frame(msg):
+    """112 bit frame as hex -> (typecode, icao, odd cpr flag, frame bytes)
+
+    None unless it's an ads-b (DF17) frame with good parity.  Fields are
+    read straight from the bytes; only the heavier decodes need pyModeS.
+    """
+    try:
+        frame = bytearray(unhexlify(msg))
+    except TypeError:  # not hex
+        return
+
+    if frame[0] >> 3 != 17:  # ads-b only
+        return
+
+    if crc24(frame[:11]) != (frame[11] << 16 | frame[12] << 8 | frame[13]):
+        return
+
+    return frame[4] >> 3, msg[2:8], bool(frame[6] & 0x04), frame
+
+
+def cpr_nl(lat):
+    """Number of longitude zones at a latitude"""
+    lat = abs(lat)
+    if lat == 0:
+        return 59
+    if lat == 87:
+        return 2
+    if lat > 87:
+        return 1
+
+    a = 1 - math.cos(math.pi / (2 * CPR_NZ))
+    b = math.cos(math.pi / 180 * lat) ** 2
+    return int(math.floor(2 * math.pi / math.acos(1 - a / b)))
+
+
+def cpr_local(frame, odd, ref_lat, ref_lng):
+    """(lat, lng) of one airborne position frame, from a reference within 180 nm of it"""
+    bits = frame[6] << 32 | frame[7] << 24 | frame[8] << 16 | frame[9] << 8 | frame[10]
+    lat_cpr = ((bits >> 17) & 0x1FFFF) / CPR_MAX
+    lng_cpr = (bits & 0x1FFFF) / CPR_MAX
+
+    i = 1 if odd else 0
+    dlat = 360 / (4 * CPR_NZ - i)
+    j = math.floor(ref_lat / dlat) + math.floor(0.5 + (ref_lat % dlat) / dlat - lat_cpr)
+    lat = dlat * (j + lat_cpr)
+    if abs(lat) > 90:
+        return
+
+    dlng = 360 / max(cpr_nl(lat) - i, 1)
+    m = math.floor(ref_lng / dlng) + math.floor(0.5 + (ref_lng % dlng) / dlng - lng_cpr)
+    lng = dlng * (m + lng_cpr)
+    return round(lat, 5), round((lng + 180) % 360 - 180, 5)
+
+
+def distance_nm(lat1, lng1, lat2, lng2):
+    lat1, lng1, lat2, lng2 = [math.radians(x) for x in (lat1, lng1, lat2, lng2)]
+    h = math.sin((lat2 - lat1) / 2) ** 2 + math.cos(lat1) * math.cos(lat2) * math.sin((lng2 - lng1) / 2) ** 2
+    return 2 * EARTH_RADIUS_NM * math.asin(min(1, math.sqrt(h)))
+
+
+def altitude(frame):
+    """Barometric altitude (ft) of an airborne position frame, or None if Gillham coded"""
+    if not frame[5] & 0x01:  # q bit
+        return
+    return ((frame[5] >> 1) << 4 | frame[6] >> 4) * 25 - 1000
+
+
+class Aircraft(object):
+    """What's known about one aircraft"""
+    __slots__ = ('icao', 'last_seen', 'even_msg', 'even_time', 'odd_msg', 'odd_time',
+            'lat', 'lng', 'fix_time', 'callsign', 'altitude', 'speed', 'heading', 'updownrate', 'speedtype')
+
+    def __init__(self, icao, now):
+        self.icao = icao
+        self.last_seen = now
+        self.even_msg = None
+        self.even_time = None
+        self.odd_msg = None
+        self.odd_time = None
+        self.lat = None
+        self.lng = None
+        self.fix_time = None
+        self.callsign = None
+        self.altitude = None
+        self.speed = None
+        self.heading = None
+        self.updownrate = None
+        self.speedtype = None
+
+
+class AircraftTable(object):
+    """Aircraft by ICAO address, least recently heard first
+
+    Aircraft not heard for 'ttl' seconds are dropped, as is the least
+    recently heard one when the table is full, so it stays bounded however
+    busy the sky is.
+    """
+    def __init__(self, ttl=AIRCRAFT_TTL, maxsize=MAX_AIRCRAFT):
+        self.ttl = ttl
+        self.maxsize = maxsize
+        self.aircraft = OrderedDict()
+        self.expired = 0
+        self.evicted = 0
+
+    def __len__(self):
+        return len(self.aircraft)
+
+    def seen(self, icao, now):
+        """The aircraft's record, created if new, marked as heard at 'now'"""
+        self.expire(now)
+
+        ac = self.aircraft.pop(icao, None)
+        if ac is None:
+            if len(self.aircraft) >= self.maxsize:
+                self.aircraft.popitem(last=False)
+                self.evicted += 1
+            ac = Aircraft(icao, now)
+
+        ac.last_seen = now
+        self.aircraft[icao] = ac  # to the back
+        return ac
+
+    def expire(self, now):
+        aircraft = self.aircraft
+        while aircraft:
+            icao = next(iter(aircraft))
+            if now - aircraft[icao].last_seen < self.ttl:
+                break
+            del aircraft[icao]
+            self.expired += 1
+
+
+class AdsbDecoder(object):
+    """Mode S decoding for the adsb module, kept free of i/o
+
+    Keeps what's known of each aircraft in an AircraftTable.  A position
+    frame is decoded on its own against the aircraft's last fix, or failing
+    that the station's position; only aircraft with neither fall back to
+    pairing odd and even frames.  The returned fields are reused between
+    calls.
+    """
+    def __init__(self, settings):
+        self.settings = settings
+        self.table = AircraftTable()
+        self.fields = OrderedDict()
+
+    def decode(self, line, now, station=None):
+        """One rtl_adsb output line -> report fields, or None
+
+        'station' is the receiver's (lat, lng), if known.
+        """
+        fields = self.fields
+        msg = line.strip()
+
+        if len(msg) == 0:
+            return
+
+        if not msg.startswith('*') or not msg.endswith(';'):
+            return
+
+        msg = msg[1:-1]
+        if len(msg) != 28:
+            return
+
+        parsed = parse_frame(msg)
+        if not parsed:
+            return
+        tc, icao, odd, frame = parsed
+
+        if 1 <= tc <= 4:  # identification message
+            callsign = pms.adsb.callsign(msg)
+            ac = self.table.seen(icao, now)
+            ac.callsign = callsign.strip('_')
+
+            if self.settings['print_all']:
+                print("[adsb] (ID) ICAO: {}, Callsign: {}]".format(icao, callsign))
+
+            fields['icao'] = icao
+            fields['callsign'] = ac.callsign
+            fields['aircraft_lat'] = None
+            fields['aircraft_lng'] = None
+            fields['altitude'] = None
+            fields['heading'] = None
+            fields['updownrate'] = None
+            fields['speedtype'] = None
+            fields['speed'] = None
+
+        elif 9 <= tc <= 18:  # airborne position
+            alt = altitude(frame)
+            ac = self.table.seen(icao, now)
+            ac.altitude = alt
+
+            if odd:
+                ac.odd_msg, ac.odd_time = msg, now
+            else:
+                ac.even_msg, ac.even_time = msg, now
+
+            fix = self.locate(ac, frame, odd, now, station)
+            if not fix:
+                return
+            (lat, lng), trusted = fix
+            if trusted:
+                ac.lat, ac.lng, ac.fix_time = lat, lng, now
+
+            if self.settings['print_all']:
+                print("[adsb] (POS) ICAO: {}, Lat: {}, Lng: {}, Alt: {}".format(icao, lat, lng, alt))
+
+            fields['icao'] = icao
+            fields['callsign'] = None
+            fields['aircraft_lat'] = lat
+            fields['aircraft_lng'] = lng
+            fields['altitude'] = alt
+            fields['heading'] = None
+            fields['updownrate'] = None
+            fields['speedtype'] = None
+            fields['speed'] = None
+
+        elif tc == 19:  # airborne velocities
+            velocity = pms.adsb.velocity(msg)
+            speed, heading, updownrate, speedtype = velocity
+
+            ac = self.table.seen(icao, now)
+            ac.speed, ac.heading, ac.updownrate, ac.speedtype = velocity
+
+            if self.settings['print_all']:
+                print("[adsb] (VEL) ICAO: {}, Heading: {}, ClimbRate: {}, Speedtype: {}, Speed: {}".format(icao, heading, updownrate, speedtype, speed))
+
+            fields['icao'] = icao
+            fields['callsign'] = None
+            fields['aircraft_lat'] = None
+            fields['aircraft_lng'] = None
+            fields['altitude'] = None
+            fields['heading'] = heading
+            fields['updownrate'] = updownrate
+            fields['speedtype'] = speedtype
+            fields['speed'] = speed
+
+        else:
+            return
+
+        return fields
+
+    def locate(self, ac, frame, odd, now, station):
+        """((lat, lng), trusted) for a position frame, or None
+
+        A global decode of an odd/even pair, or a local decode against a
+        recent trusted fix, is trusted and becomes the reference for the
+        aircraft's next frame.  A single frame decoded against the station
+        is reported until a pair arrives, but never chained from: a frame
+        from past the station's range can decode to a wrong position that
+        still looks near.
+        """
+        if ac.fix_time is not None and now - ac.fix_time <= FIX_MAX_AGE:
+            pos = cpr_local(frame, odd, ac.lat, ac.lng)
+            return (pos, True) if pos else None
+
+        if ac.odd_msg and ac.even_msg and abs(ac.odd_time - ac.even_time) <= CPR_PAIR_MAX:
+            pos = pms.adsb.position(ac.even_msg, ac.odd_msg, ac.even_time, ac.odd_time)
+            if pos:
+                return pos, True
+
+        if station and self.settings['local_cpr']:
+            pos = cpr_local(frame, odd, station[0], station[1])
+            if pos and distance_nm(pos[0], pos[1], station[0], station[1]) <= STATION_REF_RANGE:
+                return pos, False
+
+
 class Adsb(threading.Thread):
+    """rtl_adsb listener; its output is read by the shared ProcReader"""
     def __init__(self, adsb_opts, gpsp, devmod, settings):
         self.devnum = adsb_opts['devnum']
         self.gpsp = gpsp
@@ -61,161 +361,74 @@ class Adsb(threading.Thread):
         self.cmdpipe = Popen([cmd, "-d {}".format(self.devnum), "-p {}".format(ppm)],
                 stdout=PIPE, close_fds=ON_POSIX)
 
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.outmsg = OrderedDict()
+        self.outmsg['stationid'] = self.station_id
+        self.decoder = AdsbDecoder(settings)
+
+        self.gpswarned = 0
+        self.reader = get_reader()
+        self.stoplock = threading.Lock()
         self.stoprequest = threading.Event()
         threading.Thread.__init__(self)
 
-    def run(self):
-        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-
-        outmsg = OrderedDict()
-        outmsg['stationid'] = self.station_id
-
-        poscache = dict()
-
-        while not self.stoprequest.isSet():
-            # look for gps here to avoid flooding the reporter in the case of no lock
-            loc = self.gpsp.get_current()
-            if (loc == None) or (loc['lat'] == "0.0" and loc['lng'] == "0.0") or (loc['lat'] == "NaN"):
-                print("[adsb] No GPS loc, waiting...")
-                time.sleep(ERROR_SLEEP)
-                continue
-
-            msg = self.cmdpipe.stdout.readline().strip()
-
-            if len(msg) == 0:
-                continue
-
-            if not msg.startswith('*') or not msg.endswith(';'):
-                continue
-
-            msg = msg[1:-1]
-            if len(msg) != 28:
-                continue
-
-            crc = pms.util.hex2bin(msg[-6:])
-            p = pms.util.crc(msg, encode=True)
-            if p != crc:
-                continue
-
-            df = pms.df(msg)  # downlink format
-            if df == 17:  # ads-b
-                tc = pms.adsb.typecode(msg)  # type code
-                if 1 <= tc <= 4:  # identification message
-                    icao = pms.adsb.icao(msg)
-                    callsign = pms.adsb.callsign(msg)
-
-                    if self.settings['print_all']:
-                        print("[adsb] (ID) ICAO: {}, Callsign: {}]".format(icao, callsign))
-
-                    outmsg['icao'] = icao
-                    outmsg['callsign'] = callsign.strip('_')
-                    outmsg['aircraft_lat'] = None
-                    outmsg['aircraft_lng'] = None
-                    outmsg['altitude'] = None
-                    outmsg['heading'] = None
-                    outmsg['updownrate'] = None
-                    outmsg['speedtype'] = None
-                    outmsg['speed'] = None
-
-                elif 9 <= tc <= 18:  # airborne position
-                    icao = pms.adsb.icao(msg)
-                    altitude = pms.adsb.altitude(msg)
-
-                    if icao in poscache.keys() and poscache[icao]:
-                        (recent_tc, recent_msg, recent_time) = poscache[icao]
-                        if recent_tc != tc:
-                            poscache[icao] = None
-                            continue
-
-                        recent_odd = (pms.util.hex2bin(recent_msg)[53] == '1')
-                        msg_odd = (pms.util.hex2bin(msg)[53] == '1')
-
-                        if recent_odd != msg_odd:
-                            if recent_odd:
-                                oddmsg = recent_msg
-                                evenmsg = msg
-                                t_odd = recent_time
-                                t_even = time.time()
-                            else:
-                                oddmsg = msg
-                                evenmsg = recent_msg
-                                t_odd = time.time()
-                                t_even = recent_time
-
-                            pos = pms.adsb.position(oddmsg, evenmsg, t_odd, t_even)
-                            if not pos:
-                                continue
-                            lat, lng = pos
-
-                        else:
-                            poscache[icao] = (tc, msg, time.time())
-                            continue
-
-                    else:
-                        poscache[icao] = (tc, msg, time.time())
-                        continue
-                    
-                    if self.settings['print_all']:
-                        print("[adsb] (POS) ICAO: {}, Lat: {}, Lng: {}, Alt: {}".format(icao, lat, lng, altitude))
-
-                    outmsg['icao'] = icao
-                    outmsg['callsign'] = None
-                    outmsg['aircraft_lat'] = lat
-                    outmsg['aircraft_lng'] = lng
-                    outmsg['altitude'] = altitude
-                    outmsg['heading'] = None
-                    outmsg['updownrate'] = None
-                    outmsg['speedtype'] = None
-                    outmsg['speed'] = None
-
-                elif tc == 19:  # airborne velocities
-                    icao = pms.adsb.icao(msg)
-		    velocity = pms.adsb.velocity(msg)
-                    speed, heading, updownrate, speedtype = velocity
-
-                    if self.settings['print_all']:
-                        print("[adsb] (VEL) ICAO: {}, Heading: {}, ClimbRate: {}, Speedtype: {}, Speed: {}".format(icao, heading, updownrate, speedtype, speed))
-
-                    outmsg['icao'] = icao
-                    outmsg['callsign'] = None
-                    outmsg['aircraft_lat'] = None
-                    outmsg['aircraft_lng'] = None
-                    outmsg['altitude'] = None
-                    outmsg['heading'] = heading
-                    outmsg['updownrate'] = updownrate
-                    outmsg['speedtype'] = speedtype
-                    outmsg['speed'] = speed
-
-                else:
-                    continue
-
-                outmsg['lat'] = float(loc['lat'])
-                outmsg['lng'] = float(loc['lng'])
-                outmsg['module'] = 'adsb'
-
-                outmsg['time'] = str(int(time.time()))
-                m = md5()
-                m.update(self.station_pass + outmsg['icao'] + outmsg['time'])
-                outmsg['sign'] = m.hexdigest()
-
-                try:
-                    sock.sendto(json.dumps(outmsg), (self.server_host, self.server_port))
-                except Exception:
-                    print("[adsb] Could not send to server, waiting...")
-                    time.sleep(ERROR_SLEEP)
-                    continue
-
-        sock.close()
-        self.cmdpipe.stdout.close()
-        self.cmdpipe.kill()
-        os.kill(self.cmdpipe.pid, 9)
-        os.wait()
+    def start(self):
+        self.reader.add(self.cmdpipe, self.on_line, self.on_eof)
 
-        return
+    def on_line(self, msg):
+        if self.stoprequest.isSet():
+            return
+
+        # look for gps here to avoid flooding the reporter in the case of no lock
+        loc = self.gpsp.get_current()
+        if (loc == None) or (loc['lat'] == "0.0" and loc['lng'] == "0.0") or (loc['lat'] == "NaN"):
+            if time.time() - self.gpswarned >= ERROR_SLEEP:
+                print("[adsb] No GPS loc, dropping messages...")
+                self.gpswarned = time.time()
+            return
+
+        fields = self.decoder.decode(msg, time.time(), (float(loc['lat']), float(loc['lng'])))
+        if not fields:
+            return
+
+        self.outmsg.update(fields)
+        self.outmsg['lat'] = float(loc['lat'])
+        self.outmsg['lng'] = float(loc['lng'])
+        self.outmsg['module'] = 'adsb'
+
+        self.outmsg['time'] = str(int(time.time()))
+        m = md5()
+        m.update(self.station_pass + self.outmsg['icao'] + self.outmsg['time'])
+        self.outmsg['sign'] = m.hexdigest()
+
+        try:
+            self.sock.sendto(json.dumps(self.outmsg), (self.server_host, self.server_port))
+        except Exception:
+            print("[adsb] Could not send to server, dropping message")
+            return
+
+    def on_eof(self):
+        if not self.stoprequest.isSet():
+            print("[adsb] rtl_adsb on device {} exited (code {})".format(self.devnum, self.cmdpipe.wait()))
+        self.stop_child()
+
+    def stop_child(self):
+        with self.stoplock:  # eof and join can race
+            if self.stoprequest.isSet():
+                return
+            self.stoprequest.set()
+
+        self.reader.remove(self.cmdpipe)
+        try:
+            self.cmdpipe.kill()
+        except OSError:  # already exited
+            pass
+        self.cmdpipe.wait()
+        self.cmdpipe.stdout.close()
+        self.sock.close()
 
     def join(self, timeout=None):
-        self.stoprequest.set()
-        super(Adsb, self).join(timeout)
+        self.stop_child()
 
 
 class GrfModuleAdsb(GrfModuleBase):
@@ -229,7 +442,8 @@ class GrfModuleAdsb(GrfModuleBase):
             raise Exception("executable rtl_adsb not found in specified path")
 
         self.cmd = command
-        self.settings = {'print_all': False}
+        self.settings = {'print_all': False,
+                'local_cpr': True}
         self.adsbthread = None
 
         print("Loading {}".format(MODULE_DESCRIPTION))
@@ -241,6 +455,7 @@ class GrfModuleAdsb(GrfModuleBase):
         print("")
         print("\tSettings:")
         print("\t\tprint_all: Print flight messages as they're intercepted")
+        print("\t\tlocal_cpr: Locate an aircraft against the station's position until an odd/even frame pair places it (off if you hear aircraft past ~{} nm)".format(STATION_REF_RANGE))
         return True
 
     def run(self, devnum, _freqs, system_params, loadedmods, remotetask=False):
@@ -272,7 +487,12 @@ class GrfModuleAdsb(GrfModuleBase):
         return
 
     def info(self):
-        return
+        if not self.adsbthread:
+            return
+
+        table = self.adsbthread.decoder.table
+        print("Tracking {} aircraft (max {}); {} expired after {} s, {} evicted when full".format(
+            len(table), table.maxsize, table.expired, table.ttl, table.evicted))
 
     def shutdown(self):
         print("Shutting down adsb module(s)")
@@ -0,0 +1,541 @@
+#!/usr/bin/env python2
+# gammarf shared capture module v0.1
+#
+# Joshua Davis (gammarf -*- covert.codes)
+# http://gammarf.io
+# Copyright(C) 2016
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+# One dongle streams raw 8 bit I/Q into a ring of fixed-size blocks in
+# shared memory, and any number of consumers read the blocks in place.
+# The producer never waits: a consumer that falls more than
+# RING_BLOCKS - LAG_GUARD blocks behind skips ahead, and counts the loss.
+#
+# Ring layout: a 64 byte header -- blocks written (uint64), samples per
+# block, block count, center freq, sample rate -- then the blocks.  The
+# file is in /dev/shm, so other processes can attach() to it too.
+
+from __future__ import division
+
+import abc
+import ctypes
+import math
+import mmap
+import numpy
+import os
+import rtlsdr
+import struct
+import tempfile
+import threading
+import time
+from uuid import uuid4
+
+from gammarf_base import GrfModuleBase
+from gammarf_dsp import BinPowerEstimator, bytes_to_iq
+from gammarf_freqwatch import DEFAULT_GAIN, EDGE_GUARD, NFFT, OFFSET, SAMPLE_RATE, ReadingSender, read_sync
+from gammarf_scanner import SweepPlan, parse_freq
+
+BLOCK_SAMPLES = 65536  # ~27 ms at SAMPLE_RATE
+DATA_OFF = 64
+DEFAULT_RECORD_DIR = 'iq'
+DEFAULT_STEP = 5000  # Hz, spectrum consumer
+ERROR_SLEEP = 3  # s
+HEADER = struct.Struct('<QIIdd')  # head, block samples, blocks, center, rate
+LAG_GUARD = 4  # blocks kept between a consumer and the block being overwritten
+MODULE_DESCRIPTION = "capture module"
+PROBE_BLOCKS = 4  # blocks integrated per probe reading, about freqwatch's dwell
+PROBE_INTERVAL = 1  # s between probe readings
+RING_BLOCKS = 64
+SHM_DIR = '/dev/shm'
+SPECTRUM_INTERVAL = 1  # s between spectrum rows
+THREAD_TIMEOUT = 5
+WAIT_TIMEOUT = 0.5  # s, waiting consumers recheck for stop this often
+
+
+def start(config):
+    return GrfModuleCapture(config)
+
+
+class IQRing(object):
+    """Single producer, many consumer ring of I/Q blocks"""
+    def __init__(self, path, create=False, center=0, rate=0):
+        self.path = path
+
+        fd = os.open(path, os.O_RDWR)
+        if create:
+            os.ftruncate(fd, DATA_OFF + 2 * BLOCK_SAMPLES * RING_BLOCKS)
+            self.mm = mmap.mmap(fd, 0)
+            HEADER.pack_into(self.mm, 0, 0, BLOCK_SAMPLES, RING_BLOCKS, center, rate)
+        else:
+            self.mm = mmap.mmap(fd, 0)
+        os.close(fd)
+
+        _, self.block_samples, self.nblocks, self.center, self.rate = HEADER.unpack_from(self.mm, 0)
+        self._head = ctypes.c_uint64.from_buffer(self.mm, 0)
+        self.blocks = numpy.frombuffer(self.mm, dtype=numpy.uint8, count=2 * self.block_samples * self.nblocks,
+                offset=DATA_OFF).reshape(self.nblocks, 2 * self.block_samples)
+        self.cond = threading.Condition()
+
+    @classmethod
+    def create(cls, center, rate):
+        shmdir = SHM_DIR if os.path.isdir(SHM_DIR) else None
+        fd, path = tempfile.mkstemp(prefix='gammarf-iq-', dir=shmdir)
+        os.close(fd)
+        return cls(path, True, center, rate)
+
+    @classmethod
+    def attach(cls, path):
+        return cls(path)
+
+    def head(self):
+        """Sequence number of the next block to be written"""
+        return self._head.value
+
+    def slot(self):
+        """Producer: the block to fill next"""
+        return self.blocks[self._head.value % self.nblocks]
+
+    def publish(self):
+        """Producer: make the filled slot visible"""
+        self._head.value += 1
+        with self.cond:
+            self.cond.notify_all()
+
+    def block(self, seq):
+        """Consumer: block 'seq', in place"""
+        return self.blocks[seq % self.nblocks]
+
+    def wait(self, seq, timeout):
+        """Consumer: wait (in-process) for block 'seq' to be published"""
+        with self.cond:
+            if self._head.value <= seq:
+                self.cond.wait(timeout)
+
+    def close(self, unlink=False):
+        del self._head, self.blocks
+        self.mm.close()
+
+        if unlink:
+            try:
+                os.unlink(self.path)
+            except OSError:
+                pass
+
+
+class Capture(threading.Thread):
+    """Producer: streams one dongle into an IQRing"""
+    def __init__(self, devnum, center, gain, ppm, devmod):
+        self.devnum = devnum
+        self.center = center
+        self.gain = gain
+        self.devmod = devmod
+
+        self.sdr = rtlsdr.RtlSdr(devnum)
+        self.sdr.set_sample_rate(SAMPLE_RATE)
+        self.sdr.set_manual_gain_enabled(1)
+        self.sdr.set_gain(gain)
+        if ppm != 0:
+            self.sdr.freq_correction = ppm
+
+        self.ring = IQRing.create(center, SAMPLE_RATE)
+        self.consumers = list()
+        self.stoprequest = threading.Event()
+        threading.Thread.__init__(self)
+
+    def run(self):
+        try:
+            self.sdr.set_center_freq(self.center)
+            read_sync(self.sdr, self.ring.slot())  # settling, not published
+
+            while not self.stoprequest.isSet():
+                read_sync(self.sdr, self.ring.slot())
+                self.ring.publish()
+        except IOError:
+            print("[capture] Error with device {}, exiting task".format(self.devnum))
+            self.devmod.removedev(self.devnum)
+
+        self.sdr.close()
+        return
+
+    def add(self, consumer):
+        consumer.daemon = True
+        consumer.start()
+        self.consumers.append(consumer)
+
+    def join(self, timeout=None):
+        for consumer in self.consumers:
+            consumer.join(timeout)
+
+        self.stoprequest.set()
+        super(Capture, self).join(timeout)
+        self.ring.close(unlink=True)
+
+
+class Consumer(threading.Thread):
+    """Reads the capture's blocks in place; subclasses implement process()"""
+    __metaclass__ = abc.ABCMeta
+
+    def __init__(self, capture):
+        self.capture = capture
+        self.ring = capture.ring
+        self.dropped = 0  # blocks skipped for falling behind
+        self.stoprequest = threading.Event()
+        threading.Thread.__init__(self)
+
+    def run(self):
+        seq = self.ring.head()
+        while not self.stoprequest.isSet():
+            head = self.ring.head()
+            if not self.wanted():
+                seq = head
+                self.stoprequest.wait(WAIT_TIMEOUT / 10)
+                continue
+
+            if seq >= head:
+                self.ring.wait(seq, WAIT_TIMEOUT)
+                continue
+
+            if head - seq > self.ring.nblocks - LAG_GUARD:
+                self.dropped += head - seq - 1
+                seq = head - 1
+
+            self.process(self.ring.block(seq))
+            seq += 1
+
+        self.finish()
+
+    def wanted(self):
+        """False to skip blocks for now (not counted as dropped)"""
+        return True
+
+    @abc.abstractmethod
+    def process(self, block):
+        """Handle one block of 8 bit interleaved I/Q; must not keep it"""
+        return
+
+    def finish(self):
+        return
+
+    def join(self, timeout=None):
+        self.stoprequest.set()
+        super(Consumer, self).join(timeout)
+
+
+class ProbeConsumer(Consumer):
+    """Channel power at fixed frequencies, reported like freqwatch"""
+    def __init__(self, capture, freqs, opts, gpsp, settings):
+        super(ProbeConsumer, self).__init__(capture)
+
+        self.freqs = freqs
+        self.gpsp = gpsp
+        self.sender = ReadingSender(opts, str(uuid4()), settings, 'capture')
+
+        self.estimator = BinPowerEstimator(NFFT, SAMPLE_RATE, [f - capture.center for f in freqs], numpy.complex64)
+        self.samples = numpy.empty(self.ring.block_samples, dtype=numpy.complex64)
+        self.acc = numpy.zeros(len(freqs))
+        self.nblocks = 0
+        self.last = 0
+        self.gpswarned = 0
+
+    def describe(self):
+        return "probe {}".format(", ".join(str(f) for f in self.freqs))
+
+    def wanted(self):
+        return self.nblocks or time.time() - self.last >= PROBE_INTERVAL
+
+    def process(self, block):
+        self.acc += self.estimator.linear_power(bytes_to_iq(block, self.samples))
+        self.nblocks += 1
+        if self.nblocks < PROBE_BLOCKS:
+            return
+
+        pwrs = 10 * numpy.log10(self.acc / self.nblocks)
+        self.acc[:] = 0
+        self.nblocks = 0
+        self.last = time.time()
+
+        loc = self.gpsp.get_current()
+        if (loc == None) or (loc['lat'] == "0.0" and loc['lng'] == "0.0") or (loc['lat'] == "NaN"):
+            if time.time() - self.gpswarned >= ERROR_SLEEP:
+                print("[capture] No GPS loc, dropping probe readings...")
+                self.gpswarned = time.time()
+            return
+
+        for freq, pwr in zip(self.freqs, pwrs.tolist()):
+            if not self.sender.send(freq, pwr, loc):
+                print("[capture] Could not send to server, dropping reading")
+
+    def finish(self):
+        self.sender.close()
+
+
+class SpectrumConsumer(Consumer):
+    """Narrowband scanner: spectrum rows of the capture, into the scanner module's reporter"""
+    def __init__(self, capture, step, scanmod):
+        super(SpectrumConsumer, self).__init__(capture)
+
+        self.plan = SweepPlan(step, SAMPLE_RATE)  # one hop, the capture's whole band
+        self.freq_low = self.plan.hop_low(capture.center)
+        self.samples = numpy.empty(self.ring.block_samples, dtype=numpy.complex64)
+        self.last = 0
+
+        self.scanmod = scanmod
+        self.freqrange = (int(self.freq_low), int(self.freq_low + self.plan.hopwidth), int(self.plan.binwidth))
+        self.source = None  # scanner module sweep source, see GrfModuleScanner.attach_capture
+
+    def describe(self):
+        return "spectrum {}:{}:{}".format(*self.freqrange)
+
+    def wanted(self):
+        return time.time() - self.last >= SPECTRUM_INTERVAL
+
+    def process(self, block):
+        self.last = time.time()
+        loc = self.source.current_loc(wait=False)
+        if not loc:
+            return
+
+        pwrs = self.plan.fft.power(bytes_to_iq(block, self.samples))
+        self.source.emit_row(self.freq_low, self.plan.binwidth, self.plan.kept(pwrs, self.freq_low), loc)
+
+    def finish(self):
+        self.scanmod.detach_capture(self.source)
+
+
+class RecorderConsumer(Consumer):
+    """Raw 8 bit I/Q to a file, as rtl_sdr writes it"""
+    def __init__(self, capture, path, seconds):
+        super(RecorderConsumer, self).__init__(capture)
+
+        self.path = path
+        self.remaining = int(math.ceil(seconds * SAMPLE_RATE / self.ring.block_samples)) if seconds else None
+        self.f = open(path, 'wb')
+
+    def describe(self):
+        return "record to {}".format(self.path)
+
+    def process(self, block):
+        try:
+            self.f.write(block.data)
+        except IOError as e:
+            print("[capture] Could not record to {}: {}, stopping recorder".format(self.path, e))
+            self.stoprequest.set()
+            return
+
+        if self.remaining is not None:
+            self.remaining -= 1
+            if not self.remaining:
+                print("[capture] Finished recording {}".format(self.path))
+                self.stoprequest.set()
+
+    def finish(self):
+        self.f.close()
+
+
+class GrfModuleCapture(GrfModuleBase):
+    def __init__(self, config):
+        record_dir = config.capture.record_dir
+        if not isinstance(record_dir, str) or not record_dir:
+            record_dir = DEFAULT_RECORD_DIR
+
+        self.record_dir = record_dir
+        self.captures = dict()  # devnum -> Capture
+        self.remotetask = False
+
+        self.settings = {'print_all': False,
+                'gain': DEFAULT_GAIN}
+
+        print("Loading {}".format(MODULE_DESCRIPTION))
+
+    def help(self):
+        print("Capture: Share one device's {:.1f} MHz between several consumers".format(SAMPLE_RATE / 1e6))
+        print("")
+        print("Usage: capture rtl_devnum center_freq")
+        print("\tThen attach consumers to the running capture:")
+        print("\t\tcapture rtl_devnum probe freq1 ... freqn: Report power on each frequency, like freqwatch")
+        print("\t\tcapture rtl_devnum spectrum [step]: Feed the capture's spectrum to the scanner module")
+        print("\t\tcapture rtl_devnum record [seconds]: Record raw I/Q (rtl_sdr format) to record_dir")
+        print("\tExample: > run capture 0 92M")
+        print("\t         > run capture 0 probe 91.9M 93.3M")
+        print("")
+        print("\tSettings:")
+        print("\t\tprint_all: Print probe readings to console")
+        print("\t\tgain: RTL-SDR gain (applies to new captures)")
+        return True
+
+    def run(self, devnum, cmdline, system_params, loadedmods, remotetask=False):
+        self.remotetask = remotetask
+
+        if not cmdline:
+            print("Must include a center frequency, or a consumer to attach")
+            return
+
+        args = cmdline.split()
+        capture = self.captures.get(devnum)
+        if not capture:
+            try:
+                center = parse_freq(args[0])
+            except ValueError:
+                print("Bad center frequency")
+                return
+
+            devmod = loadedmods['devices']
+            capture = Capture(devnum, center, self.settings['gain'], devmod.get_ppm(devnum), devmod)
+            capture.daemon = True
+            capture.start()
+            self.captures[devnum] = capture
+
+            print("Capture on device {}, {} +/- {:.1f} MHz, at {}".format(devnum, center, SAMPLE_RATE / 2e6, capture.ring.path))
+            return True
+
+        kind = args[0]
+        if kind == 'probe':
+            consumer = self.probe(capture, args[1:], system_params, loadedmods)
+        elif kind == 'spectrum':
+            consumer = self.spectrum(capture, args[1:], system_params, loadedmods)
+        elif kind == 'record':
+            consumer = self.recorder(capture, devnum, args[1:])
+        else:
+            print("Device {} is already capturing; attach a probe, spectrum or record consumer".format(devnum))
+            return
+
+        if not consumer:
+            return
+
+        capture.add(consumer)
+        print("Attached {} to the capture on device {}".format(consumer.describe(), devnum))
+        return  # the device is already occupied by the capture
+
+    def probe(self, capture, args, system_params, loadedmods):
+        freqs = list()
+        for arg in args:
+            try:
+                freq = parse_freq(arg)
+            except ValueError:
+                print("Frequencies should be numeric, and may include the suffixes 'M' and 'k'")
+                return
+
+            offset = abs(freq - capture.center)
+            if offset > SAMPLE_RATE / 2 - EDGE_GUARD or offset < OFFSET:
+                print("{} is outside the capture, or too close to its center".format(freq))
+                return
+            freqs.append(freq)
+
+        if not freqs:
+            print("Must include frequencies to probe")
+            return
+
+        return ProbeConsumer(capture, freqs, system_params, loadedmods['location'].gps_worker, self.settings)
+
+    def spectrum(self, capture, args, system_params, loadedmods):
+        if 'scanner' not in loadedmods:
+            print("The spectrum consumer needs the scanner module")
+            return
+
+        try:
+            step = parse_freq(args[0]) if args else DEFAULT_STEP
+        except ValueError:
+            print("Bad step")
+            return
+
+        if step <= 0:
+            print("Bad step")
+            return
+
+        scanmod = loadedmods['scanner']
+        consumer = SpectrumConsumer(capture, step, scanmod)
+        consumer.source = scanmod.attach_capture(capture.devnum, consumer.freqrange, capture.gain, system_params, loadedmods)
+        return consumer
+
+    def recorder(self, capture, devnum, args):
+        try:
+            seconds = float(args[0]) if args else None
+        except ValueError:
+            print("Bad duration")
+            return
+
+        if not os.path.isdir(self.record_dir):
+            os.makedirs(self.record_dir)
+
+        path = os.path.join(self.record_dir, "capture_{}_{}_{}_{}.cu8".format(devnum, int(capture.center), int(SAMPLE_RATE), int(time.time())))
+        try:
+            return RecorderConsumer(capture, path, seconds)
+        except IOError as e:
+            print("Could not record to {}: {}".format(path, e))
+            return
+
+    def report(self):
+        return
+
+    def info(self):
+        for devnum, capture in self.captures.items():
+            print("Device {}: {} at {}".format(devnum, capture.center, capture.ring.path))
+            for consumer in capture.consumers:
+                if consumer.is_alive():
+                    print("\t{} ({} blocks dropped)".format(consumer.describe(), consumer.dropped))
+
+    def shutdown(self):
+        print("Shutting down capture module(s)")
+        for capture in self.captures.values():
+            capture.join(THREAD_TIMEOUT)
+        self.captures = dict()
+
+        return
+
+    def showconfig(self):
+        print("Capture recordings go to '{}'".format(self.record_dir))
+
+    def setting(self, setting, arg=None):
+        if setting == None:
+            for setting, state in self.settings.items():
+                print("{}: {} ({})".format(setting, state, type(state)))
+            return True
+
+        if setting == 0:
+            return self.settings.keys()
+
+        if setting not in self.settings.keys():
+            return False
+
+        if isinstance(self.settings[setting], bool):
+            new = not self.settings[setting]
+        elif not arg:
+            print("Non-boolean setting requires an argument")
+            return True
+        else:
+            if isinstance(self.settings[setting], int):
+                new = int(arg)
+            elif isinstance(self.settings[setting], float):
+                new = float(arg)
+            else:
+                new = arg
+
+        self.settings[setting] = new
+
+        return True
+
+    def stop(self, devnum, devmod):
+        capture = self.captures.pop(devnum, None)
+        if not capture:
+            return False
+
+        capture.join(THREAD_TIMEOUT)
+        if not self.remotetask:
+            devmod.freedev(devnum)
+
+        return True
+
+    def ispseudo(self):
+        return False
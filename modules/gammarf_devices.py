@@ -90,6 +90,10 @@ class GrfModuleDevices(GrfModuleBase):
         dev = self.devs[devnum]
         return dev.ppm
 
+    def get_serial(self, devnum):
+        dev = self.devs[devnum]
+        return dev.serial
+
     def get_agf(self):
         return self.agf
 
@@ -101,6 +105,11 @@ class GrfModuleDevices(GrfModuleBase):
     def get_devs(self):
         return [dtup[1].name for dtup in self.devs.items()]
 
+    def free_devs(self):
+        """Devnums of real devices that are usable, unreserved and unoccupied"""
+        return [devnum for devnum, dev in sorted(self.devs.items())
+                if devnum < self.devcount and dev.usable and not dev.reserved and not dev.job]
+
     def occupied(self, devnum):
         if not self.devs.has_key(devnum):
             return False
@@ -0,0 +1,143 @@
+#!/usr/bin/env python2
+# gammarf dsp helpers v0.1
+#
+# Joshua Davis (gammarf -*- covert.codes)
+# http://gammarf.io
+# Copyright(C) 2016
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+
+from __future__ import division
+
+import numpy
+
+POWER_FLOOR = 1e-20  # keep log10 finite on all-zero input
+
+_iq_lut = None
+
+
+def next_2_to_pow(val):
+    val -= 1
+    val |= val >> 1
+    val |= val >> 2
+    val |= val >> 4
+    val |= val >> 8
+    val |= val >> 16
+    return val + 1
+
+
+def iq_lut():
+    """complex64 sample for every little-endian (I, Q) byte pair read as a uint16"""
+    global _iq_lut
+
+    if _iq_lut is None:
+        pairs = numpy.arange(65536)
+        lut = numpy.empty(65536, dtype=numpy.complex64)
+        lut.real = ((pairs & 0xff) - 127.5) / 127.5
+        lut.imag = ((pairs >> 8) - 127.5) / 127.5
+        _iq_lut = lut
+
+    return _iq_lut
+
+
+def bytes_to_iq(buf, out):
+    """Convert 8 bit interleaved I/Q (uint8 array) into 'out', a complex64 array"""
+    numpy.take(iq_lut(), buf.view(numpy.uint16), out=out, mode='clip')  # 'clip' writes in place
+    return out
+
+
+def settle_point(samples, chunk, tolerance):
+    """Samples to drop from a capture taken right after a retune
+
+    The capture counts as settled after the last chunk in its first half
+    whose mean power is more than 'tolerance' dB off the second half's median.
+    """
+    nchunks = len(samples) // chunk
+    frames = samples[:nchunks * chunk].reshape(nchunks, chunk)
+    pwr = 10 * numpy.log10((frames.real ** 2 + frames.imag ** 2).mean(axis=1) + POWER_FLOOR)
+
+    half = nchunks // 2
+    off = numpy.flatnonzero(numpy.abs(pwr[:half] - numpy.median(pwr[half:])) > tolerance)
+    return (int(off[-1]) + 1) * chunk if len(off) else 0
+
+
+class SweepFFT(object):
+    """Averaged, windowed power spectrum of one hop's worth of IQ samples"""
+    def __init__(self, nfft):
+        self.nfft = nfft
+        self.window = numpy.hanning(nfft).astype(numpy.float32)
+        self.scale = 1.0 / (nfft * numpy.sum(self.window ** 2))
+
+    def power(self, samples):
+        """dB power per bin, DC centered (fftshift order)"""
+        segments = len(samples) // self.nfft
+        if not segments:
+            return None
+
+        frames = samples[:segments * self.nfft].reshape(segments, self.nfft) * self.window
+        spectrum = numpy.fft.fft(frames, axis=1)
+        pwr = (spectrum.real ** 2 + spectrum.imag ** 2).mean(axis=0) * self.scale
+
+        return numpy.fft.fftshift(10 * numpy.log10(pwr + POWER_FLOOR)).astype(numpy.float32)
+
+
+def psd(samples, nfft, rate, window):
+    """Power spectral density of complex samples, DC centered
+
+    Same as matplotlib.mlab.psd(samples, NFFT=nfft, Fs=rate, window=window):
+    non-overlapping segments, no detrending, scaled by rate.
+    """
+    segments = len(samples) // nfft
+    if not segments:
+        return None
+
+    frames = samples[:segments * nfft].reshape(segments, nfft) * window
+    spectrum = numpy.fft.fft(frames, axis=1)
+    pwr = (spectrum.real ** 2 + spectrum.imag ** 2).mean(axis=0) / (rate * numpy.sum(window ** 2))
+
+    return numpy.fft.fftshift(pwr)
+
+
+class BinPowerEstimator(object):
+    """Power in the psd() bins at the given offsets (Hz) from the capture's center
+
+    Correlates each segment against precomputed windowed complex
+    exponentials instead of taking a full FFT.  Same values as picking the
+    bins out of psd(samples, nfft, rate / 1e6, hamming(nfft)).
+    """
+    def __init__(self, nfft, rate, offsets, dtype=numpy.complex128):
+        self.nfft = nfft
+        window = numpy.hamming(nfft)
+        bin_offsets = numpy.array([int(offset / (rate / nfft)) for offset in offsets])
+        kernel = window[:, None] * numpy.exp(-2j * numpy.pi * numpy.outer(numpy.arange(nfft), bin_offsets) / nfft)
+        self.kernel = kernel.astype(dtype)  # match the samples' dtype so they aren't upcast
+        self.scale = 1.0 / (rate / 1e6 * numpy.sum(window ** 2))
+
+    def linear_power(self, samples):
+        """Linear power per offset, or None if there's less than one segment of samples"""
+        segments = len(samples) // self.nfft
+        if not segments:
+            return None
+
+        bins = samples[:segments * self.nfft].reshape(segments, self.nfft).dot(self.kernel)
+        return (bins.real ** 2 + bins.imag ** 2).mean(axis=0) * self.scale
+
+    def power(self, samples):
+        """dB power per offset, or None if there's less than one segment of samples"""
+        pwr = self.linear_power(samples)
+        if pwr is None:
+            return None
+
+        return (10 * numpy.log10(pwr)).tolist()
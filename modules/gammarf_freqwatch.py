@@ -22,43 +22,313 @@
 from __future__ import division
 
 import abc
+import ctypes
 import itertools
 import json
 import math
+import numpy
+import Queue
 import rtlsdr
 import socket
 import threading
 import time
-import matplotlib.mlab as mlab
 from collections import OrderedDict
-from numpy import hamming
 from hashlib import md5
+from rtlsdr.librtlsdr import librtlsdr
 from uuid import uuid4
 
 from gammarf_base import GrfModuleBase
+from gammarf_dsp import BinPowerEstimator, bytes_to_iq, next_2_to_pow, settle_point
 
+CALIBRATION_RUNS = 4  # retunes measured for the settle time
+CALIBRATION_SAMPLES = 65536
 DEFAULT_GAIN = 36.4
-DWELL = 0.1
+DEFAULT_SETTLE = 0.010  # s, tuners without a known settle time
+DEFAULT_MAX_REVISIT = 30.0  # s, quietest windows
+DEFAULT_MIN_REVISIT = 1.0  # s, busiest windows
+DWELL = 0.1  # s, longest capture per window
+EDGE_GUARD = 200e3  # keep targets out of the dongle's filter roll-off
 ERROR_SLEEP = 3  # s
-LOOP_DELAY = 1
+FILL_FRACTION = 0.5  # of its interval, after which a window may be taken early when none is due
+MAX_SETTLE = 0.050  # s
+MIN_DWELL = 0.25  # of DWELL, for windows whose readings barely move
 MODULE_DESCRIPTION = "freqwatch module"
-OFFSET = 200e3
+OFFSET = 200e3  # targets are kept at least this far from the dc spike
 NFFT = 1024
+PIPELINE_DEPTH = 3  # capture buffers; bounds how far capture runs ahead of dsp
+REPORT_QUEUE_LEN = 256
 SAMPLE_RATE = 2.4e6
+SD_REF = 1.0  # dB; readings varying this much get twice the quietest revisit rate
+SETTLE_CHUNK = 256  # samples; settle discards are whole 512 byte usb blocks
+SETTLE_TOLERANCE = 3.0  # dB from the settled power
+STATS_INTERVAL = 30  # s
 THREAD_TIMEOUT = 5
+TUNER_SETTLE = {1: 0.010, 5: 0.005, 6: 0.005}  # s, by librtlsdr tuner type: e4000, r820t, r828d
+VAR_ALPHA = 0.2  # weight of the newest reading in the running variance
 
 
 def start(config):
     return GrfModuleFreqwatch(config)
 
 
-class Monitor(threading.Thread):
-    def __init__(self, opts, gpsp, devmod, settings):
-        self.devnum = opts['devnum']
-        self.station_id = opts['station_id']
+def place_window(targets):
+    """Best center for sorted targets in one capture, or None if they don't fit
+
+    Targets must be at least OFFSET from the center and within the usable
+    band; of the centers that allow it, take the one keeping the farthest
+    target closest in.
+    """
+    reach = SAMPLE_RATE / 2 - EDGE_GUARD
+    low, high = targets[-1] - reach, targets[0] + reach
+
+    best = None
+    for center in [t - OFFSET for t in targets] + [t + OFFSET for t in targets] + [low, high]:
+        if center < low or center > high:
+            continue
+        if min(abs(t - center) for t in targets) < OFFSET:
+            continue
+
+        spread = max(abs(t - center) for t in targets)
+        if best is None or spread < best[0]:
+            best = (spread, center)
+
+    return best[1] if best else None
+
+
+def plan_windows(freqlist):
+    """Group targets into as few captures as possible: [(center, [freq, ...])]"""
+    windows = list()
+    remaining = sorted(set(freqlist))
+    while remaining:
+        # widest run from the lowest target that one center can cover
+        for count in range(len(remaining), 0, -1):
+            group = remaining[:count]
+            if group[-1] - group[0] > SAMPLE_RATE - 2 * EDGE_GUARD:
+                continue
+
+            center = place_window(group)
+            if center is not None:
+                break
+
+        windows.append( (center, group) )
+        remaining = remaining[count:]
+
+    return windows
+
+
+def parse_target(target):
+    """'93.3M' or '93.3M:4' (priority 4) -> (freq in Hz, priority)"""
+    freq, _, priority = target.partition(':')
+    priority = int(priority) if priority else 1
+    if priority < 1:
+        raise ValueError("priority must be at least 1")
+
+    if freq[len(freq)-1] == 'M':
+        return int(float(freq[:len(freq)-1])*1e6), priority
+    elif freq[len(freq)-1] == 'k':
+        return int(float(freq[:len(freq)-1])*1e3), priority
+    return int(freq), priority
+
+
+def read_sync(sdr, buf):
+    """Synchronous read from an open RtlSdr straight into buf, a uint8 array
+    (pyrtlsdr's read_bytes goes through one buffer of its own)"""
+    nread = ctypes.c_int(0)
+    result = librtlsdr.rtlsdr_read_sync(sdr.dev_p, buf.ctypes.data_as(ctypes.POINTER(ctypes.c_ubyte)),
+            len(buf), ctypes.byref(nread))
+    if result < 0 or nread.value != len(buf):
+        raise IOError("read of {} bytes failed ({}, got {})".format(len(buf), result, nread.value))
+
+
+def tuner_settle(sdr):
+    """Samples to discard after a retune of sdr, by its tuner's nominal settle time, in whole SETTLE_CHUNKs"""
+    settle = TUNER_SETTLE.get(librtlsdr.rtlsdr_get_tuner_type(sdr.dev_p), DEFAULT_SETTLE) * SAMPLE_RATE
+    return int(math.ceil(settle / SETTLE_CHUNK)) * SETTLE_CHUNK
+
+
+class RevisitScheduler(object):
+    """Decides which window to capture next, and for how long
+
+    Each window's revisit interval shrinks with its priority and with the
+    running standard deviation of its readings, between the min_revisit
+    and max_revisit settings; steady windows also get a shorter dwell.
+    An interval is the slowest a window is revisited; while nothing is
+    due, windows past FILL_FRACTION of theirs (and min_revisit) are taken
+    early, so the rest of the device's time follows the same rates.
+    Readings come back from the dsp stage, so this is locked.
+    """
+    def __init__(self, windows, priorities, settings):
+        self.settings = settings
+        self.lock = threading.Lock()
+
+        count = len(windows)
+        self.centers = [center for center, _ in windows]
+        self.freqs = [freqs for _, freqs in windows]
+        self.direction = 1  # retunes sweep up, then back down, through the due windows
+        self.priority = [max(priorities.get(f, 1) for f in freqs) for freqs in self.freqs]
+        self.due = [0.0] * count  # all windows are captured once up front
+        self.visited = [None] * count
+        self.achieved = [None] * count  # running mean of the actual revisit interval
+        self.dwell = [1.0] * count
+        self.mean = [None] * count  # per target dB
+        self.var = [[SD_REF ** 2] * len(freqs) for freqs in self.freqs]  # unknown counts as moderately busy
+
+    def interval(self, index):
+        low = self.settings['min_revisit']
+        high = max(self.settings['max_revisit'], low)
+        sd = math.sqrt(max(self.var[index]))
+        return min(max(high / (self.priority[index] * (1 + sd / SD_REF)), low), high)
+
+    def next(self, now, tuned=None, fill=True):
+        """(window to capture, 0) or (None, seconds until one is due)
+
+        Of the due windows, take the nearest one onward from 'tuned' (the
+        current center) in the sweep direction, so a batch of due windows
+        costs one pass across the band rather than a jump per window.  A
+        window more than max_revisit late is taken first regardless.
+
+        With none due and 'fill' set, the same choice is made among the
+        windows past FILL_FRACTION of their interval and min_revisit.
+        """
+        with self.lock:
+            windows = range(len(self.due))
+            late = min(windows, key=lambda i: self.due[i])
+            if self.due[late] <= now and (tuned is None or now - self.due[late] > self.settings['max_revisit']):
+                return late, 0
+
+            due = [i for i in windows if self.due[i] <= now]
+            if not due:
+                if not fill:
+                    return None, self.due[late] - now
+
+                low = self.settings['min_revisit']
+                early = [self.visited[i] + max(FILL_FRACTION * self.interval(i), low) for i in windows]
+                due = [i for i in windows if early[i] <= now]
+                if not due:
+                    return None, min(early) - now
+                if tuned is None:
+                    return min(due, key=lambda i: early[i]), 0
+
+            ahead = [i for i in due if (self.centers[i] - tuned) * self.direction >= 0]
+            if not ahead:
+                self.direction = -self.direction
+                ahead = due
+            return min(ahead, key=lambda i: abs(self.centers[i] - tuned)), 0
+
+    def captured(self, index, now):
+        with self.lock:
+            if self.visited[index] is not None:
+                elapsed = now - self.visited[index]
+                previous = self.achieved[index]
+                self.achieved[index] = elapsed if previous is None else previous + VAR_ALPHA * (elapsed - previous)
+            self.visited[index] = now
+            self.due[index] = now + self.interval(index)
+
+    def observe(self, index, pwrs):
+        with self.lock:
+            if self.mean[index] is None:
+                self.mean[index] = list(pwrs)
+                return
+
+            mean, var = self.mean[index], self.var[index]
+            for i, pwr in enumerate(pwrs):
+                diff = pwr - mean[i]
+                mean[i] += VAR_ALPHA * diff
+                var[i] = (1 - VAR_ALPHA) * (var[i] + VAR_ALPHA * diff * diff)
+
+            if self.priority[index] > 1:
+                self.dwell[index] = 1.0
+            else:
+                self.dwell[index] = min(max(math.sqrt(max(var)) / SD_REF, MIN_DWELL), 1.0)
+
+    def stats(self):
+        """[(freq, achieved revisit s or None, target revisit s, dwell fraction)]"""
+        with self.lock:
+            return [(freq, self.achieved[i], self.interval(i), self.dwell[i])
+                    for i in range(len(self.freqs)) for freq in self.freqs[i]]
+
+
+def partition_windows(freqlist, priorities, count):
+    """Split a frequency list into 'count' lists of about equal tuning cost
+
+    Whole capture windows are dealt out, costliest first, each to the
+    least loaded device so far; a window costs its priority (how often
+    the scheduler will visit it).
+    """
+    windows = plan_windows(freqlist)
+    costs = [max(priorities.get(f, 1) for f in freqs) for _, freqs in windows]
+
+    shares = [list() for _ in range(count)]
+    loads = [0] * count
+    for i in sorted(range(len(windows)), key=lambda i: -costs[i]):
+        least = loads.index(min(loads))
+        shares[least].extend(windows[i][1])
+        loads[least] += costs[i]
+
+    return shares
+
+
+class AutoJob(object):
+    """A frequency set spread across several devices, reported under one job id"""
+    def __init__(self, freqlist, priorities, cmdline, system_params):
+        self.freqlist = freqlist
+        self.priorities = priorities
+        self.cmdline = cmdline
+        self.system_params = system_params
+        self.uuid = str(uuid4())
+        self.devnums = list()
+
+    def partition(self, count):
+        return partition_windows(self.freqlist, self.priorities, count)
+
+
+class ReadingSender(object):
+    """Sends power readings to the server as freqwatch reports them"""
+    def __init__(self, opts, jobid, settings, tag='freqwatch'):
         self.station_pass = opts['station_pass']
         self.server_host = opts['server_host']
         self.server_port = opts['server_port']
+        self.jobid = jobid
+        self.settings = settings
+        self.tag = tag
+
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.outmsg = OrderedDict()
+        self.outmsg['stationid'] = opts['station_id']
+
+    def send(self, freq, pwr, loc):
+        """False if the reading couldn't be sent"""
+        pwr = "{:.2f}".format(pwr)
+
+        if self.settings['print_all']:
+            print("[{}] Freq: {}, Pwr: {}, Lat: {}, Lng: {}".format(self.tag, freq, pwr, loc['lat'], loc['lng']))
+
+        outmsg = self.outmsg
+        outmsg['freq'] = freq
+        outmsg['pwr'] = float(pwr)
+        outmsg['lat'] = float(loc['lat'])
+        outmsg['lng'] = float(loc['lng'])
+        outmsg['module'] = 'freqwatch'
+        outmsg['jobid'] = self.jobid
+        outmsg['time'] = str(int(time.time()))
+        m = md5()
+        m.update(self.station_pass + str(outmsg['pwr']) + outmsg['time'])
+        outmsg['sign'] = m.hexdigest()
+
+        try:
+            self.sock.sendto(json.dumps(outmsg), (self.server_host, self.server_port))
+        except Exception:
+            return False
+
+        return True
+
+    def close(self):
+        self.sock.close()
+
+
+class Monitor(threading.Thread):
+    def __init__(self, opts, gpsp, devmod, settings):
+        self.devnum = opts['devnum']
         self.freqlist = opts['freqlist']
         self.jobid = opts['uuid']
 
@@ -76,14 +346,36 @@ class Monitor(threading.Thread):
         self.gain = self.settings['gain']
         self.sdr.set_gain(self.gain)
 
+        self.windows = list()  # (center, freqs, estimator)
+        plan = plan_windows(self.freqlist)
+        for center, freqs in plan:
+            self.windows.append( (center, freqs,
+                    BinPowerEstimator(NFFT, SAMPLE_RATE, [f - center for f in freqs], numpy.complex64)) )
+        self.scheduler = RevisitScheduler(plan, opts['priorities'], settings)
+
+        # capture -> dsp -> send, each stage on its own thread
+        self.numsamps = next_2_to_pow(int(DWELL * SAMPLE_RATE))
+        self.pool = Queue.Queue()  # free capture buffers, 8 bit I/Q as read
+        for _ in range(PIPELINE_DEPTH):
+            self.pool.put(numpy.empty(self.numsamps * 2, dtype=numpy.uint8))
+        self.captured = Queue.Queue(PIPELINE_DEPTH)
+        self.reports = Queue.Queue(REPORT_QUEUE_LEN)
+        self.sender = ReadingSender(opts, self.jobid, settings)
+
         self.stoprequest = threading.Event()
         threading.Thread.__init__(self)
 
     def run(self):
-        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-        outmsg = OrderedDict()
-        outmsg['stationid'] = self.station_id
+        """Capture stage: tune and read each window into a free pool buffer"""
+        stages = [threading.Thread(target=self.dsp_stage), threading.Thread(target=self.send_stage)]
+        for stage in stages:
+            stage.daemon = True
+            stage.start()
 
+        self.calibrate_settle()
+
+        stats_start = time.time()
+        tuned = None
         while not self.stoprequest.isSet():
             loc = self.gpsp.get_current()
             if (loc == None) or (loc['lat'] == "0.0" and loc['lng'] == "0.0") or (loc['lat'] == "NaN"):
@@ -95,71 +387,127 @@ class Monitor(threading.Thread):
                 self.gain = self.settings['gain']
                 self.sdr.set_gain(self.gain)
 
-            numsamps = DWELL * SAMPLE_RATE
-            numsamps = self.next_2_to_pow(int(numsamps))
-
-            for freq in self.freqlist:
-                freq = freq - OFFSET  # avoid any dc spike
-                self.sdr.set_center_freq(freq)
-                samples = self.sdr.read_samples(numsamps)
-
-                if not len(samples):
-                    continue
-
-                powers, freqs = mlab.psd(samples, NFFT=NFFT, Fs=SAMPLE_RATE/1e6, window=hamming(NFFT))
-                bin_offset = int(OFFSET/(SAMPLE_RATE / NFFT))
-                freq = int(freq + OFFSET)
-                pwr = "{:.2f}".format(10 * math.log10( powers[ int(len(powers)/2) + bin_offset ] ))
-
-                if self.settings['print_all']:
-                    print("[freqwatch] Freq: {}, Pwr: {}, Lat: {}, Lng: {}".format(freq, pwr, loc['lat'], loc['lng']))
-
-                outmsg['freq'] = freq
-                outmsg['pwr'] = float(pwr)
-                outmsg['lat'] = float(loc['lat'])
-                outmsg['lng'] = float(loc['lng'])
-                outmsg['module'] = 'freqwatch'
-                outmsg['jobid'] = self.jobid
-                outmsg['time'] = str(int(time.time()))
-                m = md5()
-                m.update(self.station_pass + str(outmsg['pwr']) + outmsg['time'])
-                outmsg['sign'] = m.hexdigest()
-
-                try:
-                    sock.sendto(json.dumps(outmsg), (self.server_host, self.server_port))
-                except Exception:
-                    print("[freqwatch] Could not send to server, waiting...")
-                    time.sleep(ERROR_SLEEP)
-                    continue
-
-            time.sleep(LOOP_DELAY)
+            now = time.time()
+            if self.settings['stats'] and now - stats_start >= STATS_INTERVAL:
+                self.print_stats()
+                stats_start = now
+
+            index, wait = self.scheduler.next(now, tuned)
+            if index is None:
+                self.stoprequest.wait(wait)
+                continue
+
+            try:
+                buf = self.pool.get(True, THREAD_TIMEOUT)
+            except Queue.Empty:  # dsp stage stuck or gone
+                continue
+
+            center, _, _ = self.windows[index]
+            nbytes = 2 * max(next_2_to_pow(int(self.numsamps * self.scheduler.dwell[index])), NFFT)
+            try:
+                self.sdr.set_center_freq(center)
+                tuned = center
+                if len(self.settle_buf):
+                    read_sync(self.sdr, self.settle_buf)  # pll settling and samples from before the retune
+                read_sync(self.sdr, buf[:nbytes])
+            except IOError:
+                print("[freqwatch] Error with device {}, exiting task".format(self.devnum))
+                self.pool.put(buf)
+                break
+
+            self.scheduler.captured(index, time.time())
+            self.captured.put( (index, buf, nbytes, loc) )
+
+        self.captured.put(None)
+        for stage in stages:
+            stage.join(THREAD_TIMEOUT)
 
         self.sdr.close()
-        sock.close()
         return
 
+    def calibrate_settle(self):
+        """Measure how long captures take to settle after a retune
+
+        Jumps between the outermost windows a few times and finds where the
+        power of each capture stops swinging; the result is never shorter
+        than the tuner's nominal settle time.
+        """
+        settle = tuner_settle(self.sdr)
+        centers = [self.windows[0][0], self.windows[-1][0]] if len(self.windows) > 1 else [self.windows[0][0] - 50e6, self.windows[0][0]]
+
+        buf = self.pool.get()
+        raw = buf[:2 * CALIBRATION_SAMPLES]
+        samples = numpy.empty(CALIBRATION_SAMPLES, dtype=numpy.complex64)
+        try:
+            for run in range(CALIBRATION_RUNS):
+                self.sdr.set_center_freq(centers[run % 2])
+                read_sync(self.sdr, raw)
+                settle = max(settle, settle_point(bytes_to_iq(raw, samples), SETTLE_CHUNK, SETTLE_TOLERANCE))
+        except IOError:
+            print("[freqwatch] Could not calibrate device {}, using the nominal settle time".format(self.devnum))
+        finally:
+            self.pool.put(buf)
+
+        settle = min(int(math.ceil(settle / SETTLE_CHUNK)) * SETTLE_CHUNK, int(MAX_SETTLE * SAMPLE_RATE))
+        settle = settle // SETTLE_CHUNK * SETTLE_CHUNK  # the cap needn't be a whole number of chunks
+        self.settle_buf = numpy.empty(2 * settle, dtype=numpy.uint8)  # reused, never looked at
+        print("[freqwatch] Device {} settles {:.1f} ms after a retune".format(self.devnum, settle / SAMPLE_RATE * 1000))
+
+    def dsp_stage(self):
+        samples = numpy.empty(self.numsamps, dtype=numpy.complex64)
+
+        while True:
+            item = self.captured.get()
+            if item is None:
+                break
+
+            index, buf, nbytes, loc = item
+            _, freqs, estimator = self.windows[index]
+            bytes_to_iq(buf[:nbytes], samples[:nbytes // 2])
+            self.pool.put(buf)
+
+            pwrs = estimator.power(samples[:nbytes // 2])
+            self.scheduler.observe(index, pwrs)
+            for freq, pwr in zip(freqs, pwrs):
+                self.reports.put( (freq, pwr, loc) )
+
+        self.reports.put(None)
+
+    def send_stage(self):
+        while True:
+            report = self.reports.get()
+            if report is None:
+                break
+
+            if not self.sender.send(*report):
+                print("[freqwatch] Could not send to server, waiting...")
+                time.sleep(ERROR_SLEEP)
+
+        self.sender.close()
+
+    def print_stats(self):
+        for freq, achieved, target, dwell in self.scheduler.stats():
+            achieved = "{:.1f} s".format(achieved) if achieved is not None else "-"
+            print("[freqwatch] Device {}, {}: revisit {} (target {:.1f} s), dwell {:.0f}%".format(
+                self.devnum, freq, achieved, target, dwell * 100))
+
     def join(self, timeout=None):
         self.stoprequest.set()
         super(Monitor, self).join(timeout)
 
-    def next_2_to_pow(self, val):
-        val -= 1
-        val |= val >> 1
-        val |= val >> 2
-        val |= val >> 4
-        val |= val >> 8
-        val |= val >> 16
-        return val + 1
-
 
 class GrfModuleFreqwatch(GrfModuleBase):
     def __init__(self, config):
         self.monitors = list()
+        self.autojob = None
         self.agf = None
         self.config = config
 
         self.settings = {'print_all': True,
-                'gain': DEFAULT_GAIN}
+                'gain': DEFAULT_GAIN,
+                'min_revisit': DEFAULT_MIN_REVISIT,
+                'max_revisit': DEFAULT_MAX_REVISIT,
+                'stats': False}
 
         print("Loading {}".format(MODULE_DESCRIPTION))
 
@@ -168,23 +516,68 @@ class GrfModuleFreqwatch(GrfModuleBase):
         print("")
         print("Usage: freqwatch rtl_devnum freq1 ... freqn")
         print("\tExample: > run freqwatch 0 200M 210M")
+        print("\tAppend :n to a frequency to visit it n times as often (eg. 210M:4)")
         print("")
         print("\tYou can use sets in the configuration file (gammarf.conf)")
         print("\tExample: set0 = 123.4, 456.7")
         print("\t> run freqwatch 0 set0")
+        print("\tOr spread a set across every free device, as one job:")
+        print("\t> run freqwatch auto set0")
         print("\tSettings:")
         print("\t\tprint_all: Print power readings to console")
         print("\t\tgain: RTL-SDR gain")
+        print("\t\tmin_revisit, max_revisit: Bounds (s) on how often a frequency is measured; busier ones are measured more often")
+        print("\t\tstats: Periodically print each frequency's achieved revisit interval")
         return True
 
     def run(self, devnum, cmdline, system_params, loadedmods, remotetask=False):
         self.remotetask = remotetask
         devmod = loadedmods['devices']
+        self.setup(loadedmods)
+
+        targets = self.parse_targets(cmdline)
+        if not targets:
+            return
+        freqlist, priorities = targets
+
+        self.start_monitor(devnum, freqlist, priorities, str(uuid4()), system_params, devmod)
+        return True
+
+    def run_auto(self, cmdline, system_params, loadedmods):
+        """Spread one job across every free device; they occupy themselves"""
+        if self.autojob:
+            print("An automatic freqwatch job is already running (one allowed per node)")
+            return
+
+        devmod = loadedmods['devices']
+        self.setup(loadedmods)
+
+        targets = self.parse_targets(cmdline)
+        if not targets:
+            return
+        freqlist, priorities = targets
+
+        devnums = devmod.free_devs()
+        if not devnums:
+            print("No free devices for an automatic freqwatch job")
+            return
 
+        self.autojob = AutoJob(freqlist, priorities, cmdline, system_params)
+        self.autojob.devnums = devnums
+        for devnum in devnums:
+            devmod.occupy(devnum, 'freqwatch', "auto {}".format(cmdline))
+        self.start_autojob(devmod)
+
+        print("Automatic freqwatch job {} spread across devices {}".format(self.autojob.uuid, ", ".join(str(d) for d in devnums)))
+        return True
+
+    def setup(self, loadedmods):
         if not self.agf:  # these options need to be set only once per module (not per run)
-            self.agf = devmod.get_agf()
+            self.agf = loadedmods['devices'].get_agf()
             self.gpsworker = loadedmods['location'].gps_worker
 
+    def parse_targets(self, cmdline):
+        """'set0' or a frequency list -> (freqlist, {freq: priority}), or None"""
         if not cmdline:
             self.usage()
             return
@@ -206,21 +599,20 @@ class GrfModuleFreqwatch(GrfModuleBase):
             tmpfreqs = cmdline.split()
 
         freqlist = list()
-        for freq in tmpfreqs:
+        priorities = dict()
+        for target in tmpfreqs:
             try:
-                if freq[len(freq)-1] == 'M':
-                    freq = int(float(freq[:len(freq)-1])*1e6)
-                elif freq[len(freq)-1] == 'k':
-                    freq = int(float(freq[:len(freq)-1])*1e3)
-                else:
-                    freq = int(freq)
-
+                freq, priority = parse_target(target)
             except Exception:
-                print("Frequencies should be numeric, and may include the suffixes 'M' and 'k'")
+                print("Frequencies should be numeric, and may include the suffixes 'M' and 'k', and a priority (eg. 200M:2)")
                 return
 
             freqlist.append(freq)
+            priorities[freq] = max(priority, priorities.get(freq, 1))
 
+        return freqlist, priorities
+
+    def start_monitor(self, devnum, freqlist, priorities, uuid, system_params, devmod):
         opts = {'station_id': system_params['station_id'],
                 'station_pass': system_params['station_pass'],
                 'server_host': system_params['server_host'],
@@ -228,21 +620,46 @@ class GrfModuleFreqwatch(GrfModuleBase):
                 'devnum': devnum,
                 'ppm': devmod.get_ppm(devnum),
                 'freqlist': freqlist,
-                'uuid': str(uuid4())}
+                'priorities': priorities,
+                'uuid': uuid}
 
         monitor = Monitor(opts, self.gpsworker, devmod, self.settings)
         monitor.daemon = True
         monitor.start()
         self.monitors.append( (devnum, monitor) )
 
-        print("Monitor added on device {}".format(devnum))
-        return True
+        print("Monitor added on device {} ({} frequencies in {} captures)".format(devnum, len(set(freqlist)), len(monitor.windows)))
+        return monitor
+
+    def start_autojob(self, devmod):
+        job = self.autojob
+        for devnum, freqlist in zip(job.devnums, job.partition(len(job.devnums))):
+            if freqlist:
+                self.start_monitor(devnum, freqlist, job.priorities, job.uuid, job.system_params, devmod)
+
+    def stop_monitor(self, devnum, wait=False):
+        """Stop the monitor on devnum; with 'wait', don't return while it still holds the device"""
+        for monitor in self.monitors:
+            monitor_devnum, thread = monitor
+            if monitor_devnum == devnum:
+                thread.join(THREAD_TIMEOUT)
+                while wait and thread.is_alive():
+                    print("[freqwatch] Waiting for the monitor on device {} to exit".format(devnum))
+                    thread.join(THREAD_TIMEOUT)
+                self.monitors.remove(monitor)
+                return True
+
+        return False
 
     def report(self):
         return
 
     def info(self):
-        return
+        if self.autojob:
+            print("[freqwatch] Automatic job {} ({}) on devices {}".format(self.autojob.uuid, self.autojob.cmdline,
+                ", ".join(str(d) for d in self.autojob.devnums)))
+        for _, monitor in self.monitors:
+            monitor.print_stats()
 
     def shutdown(self):
         print("Shutting down freqwatch module(s)")
@@ -250,6 +667,7 @@ class GrfModuleFreqwatch(GrfModuleBase):
             devnum, thread = monitor
             thread.join(THREAD_TIMEOUT)
 
+        self.autojob = None
         return
 
     def showconfig(self):
@@ -285,16 +703,24 @@ class GrfModuleFreqwatch(GrfModuleBase):
         return True
 
     def stop(self, devnum, devmod):
-        for monitor in self.monitors:
-            monitor_devnum, thread = monitor
-            if monitor_devnum == devnum:
-                thread.join(THREAD_TIMEOUT)
-
-                if not self.remotetask:
-                    devmod.freedev(devnum)
+        job = self.autojob
+        if job and devnum in job.devnums:  # hand its share to the job's other devices
+            for other in job.devnums:
+                self.stop_monitor(other, wait=True)  # the devices are reopened below
+            devmod.freedev(devnum)
+            job.devnums.remove(devnum)
+
+            if job.devnums:
+                print("Rebalancing automatic freqwatch job across devices {}".format(", ".join(str(d) for d in job.devnums)))
+                self.start_autojob(devmod)
+            else:
+                self.autojob = None
+            return True
 
-                self.monitors.remove( (monitor_devnum, thread) )
-                return True
+        if self.stop_monitor(devnum):
+            if not self.remotetask:
+                devmod.freedev(devnum)
+            return True
 
         return False
 
@@ -0,0 +1,140 @@
+#!/usr/bin/env python2
+# gammarf child process i/o v0.1
+#
+# Joshua Davis (gammarf -*- covert.codes)
+# http://gammarf.io
+# Copyright(C) 2016
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+# One thread poll()s the stdout of every child (rtl_power, rtl_adsb, ...),
+# splits what arrives into lines and hands them to the owning module.
+# Handlers run on this thread, so they must not block.
+
+import errno
+import fcntl
+import os
+import select
+import threading
+import traceback
+
+READ_SIZE = 65536
+POLL_MASK = select.POLLIN | select.POLLPRI | select.POLLHUP | select.POLLERR
+
+_reader = None
+_reader_lock = threading.Lock()
+
+
+def get_reader():
+    """The process-wide ProcReader, started on first use"""
+    global _reader
+
+    with _reader_lock:
+        if not _reader:
+            _reader = ProcReader()
+            _reader.daemon = True
+            _reader.start()
+
+    return _reader
+
+
+def _set_nonblocking(fd):
+    flags = fcntl.fcntl(fd, fcntl.F_GETFL)
+    fcntl.fcntl(fd, fcntl.F_SETFL, flags | os.O_NONBLOCK)
+
+
+class ProcReader(threading.Thread):
+    def __init__(self):
+        self.poller = select.poll()
+        self.handlers = dict()  # fd -> [on_line, on_eof, partial line]
+        self.lock = threading.Lock()
+
+        self.wakeup_r, self.wakeup_w = os.pipe()
+        _set_nonblocking(self.wakeup_r)
+        self.poller.register(self.wakeup_r, select.POLLIN)
+
+        threading.Thread.__init__(self)
+
+    def add(self, proc, on_line, on_eof):
+        """Dispatch each line of proc's stdout to on_line(line), then on_eof()"""
+        fd = proc.stdout.fileno()
+        _set_nonblocking(fd)
+
+        with self.lock:
+            self.handlers[fd] = [on_line, on_eof, '']
+        self.poller.register(fd, POLL_MASK)
+        os.write(self.wakeup_w, 'x')
+
+    def remove(self, proc):
+        try:
+            fd = proc.stdout.fileno()
+        except ValueError:  # already closed
+            return
+
+        self._drop(fd)
+        os.write(self.wakeup_w, 'x')
+
+    def _drop(self, fd):
+        with self.lock:
+            handler = self.handlers.pop(fd, None)
+
+        if handler:
+            try:
+                self.poller.unregister(fd)
+            except KeyError:
+                pass
+
+        return handler
+
+    def run(self):
+        while True:
+            for fd, _ in self.poller.poll():
+                if fd == self.wakeup_r:
+                    try:
+                        os.read(self.wakeup_r, READ_SIZE)
+                    except OSError:
+                        pass
+                    continue
+
+                with self.lock:
+                    handler = self.handlers.get(fd)
+                if not handler:
+                    continue
+
+                try:
+                    data = os.read(fd, READ_SIZE)
+                except OSError as e:
+                    if e.errno in (errno.EAGAIN, errno.EINTR):
+                        continue
+                    data = ''
+
+                on_line, on_eof, partial = handler
+                if not data:  # child closed its end: exited or died
+                    self._drop(fd)
+                    if partial:
+                        self._dispatch(on_line, partial)
+                    self._dispatch(on_eof)
+                    continue
+
+                lines = (partial + data).split('\n')
+                handler[2] = lines.pop()
+                for line in lines:
+                    self._dispatch(on_line, line)
+
+    def _dispatch(self, func, *args):
+        try:
+            func(*args)
+        except Exception:  # one bad handler mustn't take down every child's i/o
+            print("[procio] Handler error:")
+            traceback.print_exc()
@@ -0,0 +1,146 @@
+#!/usr/bin/env python2
+# gammarf shared-memory ring buffer v0.1
+#
+# Joshua Davis (gammarf -*- covert.codes)
+# http://gammarf.io
+# Copyright(C) 2016
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+# Single-producer, single-consumer ring of power rows in an mmap'd file.
+# The producer only ever writes 'head' and the consumer only ever writes
+# 'tail', so no lock is needed.  Counters are 32 bits (one store, atomic
+# on every platform we run on) and wrap; the capacity is a power of two
+# so positions stay consistent across the wrap.
+
+import ctypes
+import mmap
+import numpy
+import os
+import struct
+import tempfile
+
+DEFAULT_CAPACITY = 1 << 22  # bytes of row data per ring
+HEAD_OFF = 0
+TAIL_OFF = 64  # keep the counters on separate cache lines
+OVERFLOW_OFF = 128
+DATA_OFF = 192
+RECORD = struct.Struct('<iiddqdd')  # nbins, pad, freq_low, step, ct, lat, lng
+SHM_DIR = '/dev/shm'
+WRAP = -1  # nbins value marking the unused tail end of the ring
+COUNTER_MASK = 0xffffffff
+
+
+def _align(size):
+    return (size + 7) & ~7
+
+
+class RingBuffer(object):
+    def __init__(self, path, capacity, create):
+        self.path = path
+        self.capacity = capacity
+
+        fd = os.open(path, os.O_RDWR)
+        if create:
+            os.ftruncate(fd, DATA_OFF + capacity)
+        self.mm = mmap.mmap(fd, DATA_OFF + capacity)
+        os.close(fd)
+
+        self._head = ctypes.c_uint32.from_buffer(self.mm, HEAD_OFF)
+        self._tail = ctypes.c_uint32.from_buffer(self.mm, TAIL_OFF)
+        self._overflows = ctypes.c_uint32.from_buffer(self.mm, OVERFLOW_OFF)
+        self.pending = 0
+
+    @classmethod
+    def create(cls, capacity=DEFAULT_CAPACITY):
+        if capacity & (capacity - 1):
+            raise ValueError("ring capacity must be a power of two")
+
+        shmdir = SHM_DIR if os.path.isdir(SHM_DIR) else None
+        fd, path = tempfile.mkstemp(prefix='gammarf-ring-', dir=shmdir)
+        os.close(fd)
+        return cls(path, capacity, True)
+
+    @classmethod
+    def attach(cls, path, capacity=DEFAULT_CAPACITY):
+        return cls(path, capacity, False)
+
+    def empty(self):
+        """True once the consumer has taken every row written so far"""
+        return self._tail.value == self._head.value
+
+    def overflows(self):
+        return self._overflows.value
+
+    def write(self, freq_low, step, ct, lat, lng, pwrs):
+        """Producer: copy a row into the ring; False (and counted) if full"""
+        size = _align(RECORD.size + pwrs.nbytes)
+        head = self._head.value
+        used = (head - self._tail.value) & COUNTER_MASK
+        pos = head % self.capacity
+        contiguous = self.capacity - pos
+
+        need = size if contiguous >= size else size + contiguous
+        if self.capacity - used < need:
+            self._overflows.value = (self._overflows.value + 1) & COUNTER_MASK
+            return False
+
+        if contiguous < size:
+            struct.pack_into('<i', self.mm, DATA_OFF + pos, WRAP)  # records are 8-aligned, so this fits
+            head = (head + contiguous) & COUNTER_MASK
+            pos = 0
+
+        RECORD.pack_into(self.mm, DATA_OFF + pos, len(pwrs), 0, freq_low, step, ct, lat, lng)
+        numpy.frombuffer(self.mm, dtype=numpy.float32, count=len(pwrs),
+                offset=DATA_OFF + pos + RECORD.size)[:] = pwrs
+
+        self._head.value = (head + size) & COUNTER_MASK  # publish
+        return True
+
+    def read(self):
+        """Consumer: next row as (freq_low, step, ct, lat, lng, pwrs) or None
+
+        pwrs is a view into the ring; it's valid until advance() is called.
+        """
+        while True:
+            tail = self._tail.value
+            if tail == self._head.value:
+                return None
+
+            pos = tail % self.capacity
+            nbins = struct.unpack_from('<i', self.mm, DATA_OFF + pos)[0]
+            if nbins == WRAP:
+                self._tail.value = (tail + self.capacity - pos) & COUNTER_MASK
+                continue
+
+            _, _, freq_low, step, ct, lat, lng = RECORD.unpack_from(self.mm, DATA_OFF + pos)
+            pwrs = numpy.frombuffer(self.mm, dtype=numpy.float32, count=nbins,
+                    offset=DATA_OFF + pos + RECORD.size)
+            self.pending = _align(RECORD.size + 4 * nbins)
+            return (freq_low, step, ct, lat, lng, pwrs)
+
+    def advance(self):
+        """Consumer: release the row returned by the last read()"""
+        self._tail.value = (self._tail.value + self.pending) & COUNTER_MASK
+        self.pending = 0
+
+    def close(self, unlink=False):
+        del self._head, self._tail, self._overflows
+        self.mm.close()
+
+        if unlink:
+            try:
+                os.unlink(self.path)
+            except OSError:
+                pass
@@ -23,8 +23,12 @@ from __future__ import division
 
 import abc
 import json
+import math
+import numpy
 import os
+import re
 import socket
+import struct
 import threading
 import time
 from collections import OrderedDict
@@ -34,16 +38,43 @@ from subprocess import Popen, PIPE, STDOUT
 from sys import builtin_module_names
 from uuid import uuid4
 
+try:
+    import rtlsdr
+    from gammarf_freqwatch import read_sync, tuner_settle
+except Exception:  # only the native engine needs librtlsdr; keeps replay/benchmarks hardware-free
+    rtlsdr = None
+
 from gammarf_base import GrfModuleBase
+from gammarf_dsp import SweepFFT, bytes_to_iq, next_2_to_pow
+from gammarf_procio import get_reader
+from gammarf_ringbuf import RingBuffer
+from gammarf_waterfall import WaterfallWriter, read_waterfall
 
 AVG_SAMPLES = 150  # how many samples to avg before looking for hits
+BASELINE_BINS = 65536  # initial baseline table size, grows as needed
+CHECKPOINT_HEADER = struct.Struct('<8sd64sII')  # magic, saved time, key, segments, bins
+CHECKPOINT_INTERVAL = 60  # s between baseline checkpoints
+CHECKPOINT_MAGIC = 'GRFBASE1'
+CHECKPOINT_MAX_AGE = 24*60*60  # s, older baselines no longer describe the band
 CROP = 15  # %
 DEFAULT_GAIN = 8.7
 ERROR_SLEEP = 3
+DEFAULT_ENGINE = 'rtl_power'
+DEFAULT_HIT_BURST = 40  # hits that may go out back to back after a quiet spell
 DEFAULT_HIT_DB = 9.0
+DEFAULT_HIT_RATE = 20.0  # hits/sec per node, so as not to saturate the server
+DEFAULT_REPORTERS = 1
+DEFAULT_WATERFALL_DIR = 'waterfalls'
+EMPTY_READING = re.compile(r',\s*(,|$)')  # a blank field, which fromstring reads as -1
+ENGINES = ('rtl_power', 'native')
+HIT_QUEUE_LEN = 1024  # hits waiting for tokens; the oldest is dropped beyond this
 INTEGRATION_INTERVAL = 5  # group time into chunks of this many seconds
 MODULE_DESCRIPTION = "scanner module"
-REPORTER_SLEEP = 50/1000  # limit activity reporting so as not to saturate the server
+REPORTER_POLL = 10/1000  # s, control pipe wait when no rows are pending
+RING_BATCH = 64  # rows taken from one scanner before moving to the next
+STATS_INTERVAL = 10  # s
+SWEEP_AVERAGES = 32  # ffts averaged per hop by the native engine
+SWEEP_RATE = 2.4e6  # native engine sample rate
 THREAD_TIMEOUT = 3
 
 procs = list()
@@ -53,6 +84,158 @@ def start(config):
     return GrfModuleScanner(config)
 
 
+def parse_freq(f):
+    if f[len(f)-1] == 'M':
+        return int(float(f[:len(f)-1])*1e6)
+    elif f[len(f)-1] == 'k':
+        return int(float(f[:len(f)-1])*1e3)
+    return int(f)
+
+
+def parse_rtl_power_line(raw):
+    """One rtl_power CSV line -> (header, float32 powers)
+
+    header is (date, time, freq_low, freq_high, step, samples); bin i is at
+    freq_low + i*step, computed only where needed (hits, printing).
+    """
+    date, hms, freq_low, freq_high, step, samples, readings = raw.split(', ', 6)
+    pwrs = numpy.fromstring(readings, dtype=numpy.float32, sep=',')
+    if len(pwrs) != readings.count(',') + 1 or EMPTY_READING.search(readings):
+        raise ValueError("malformed readings in line")
+
+    return (date, hms, float(freq_low), float(freq_high), float(step), int(samples)), pwrs
+
+
+def parse_range(freqs):
+    """rtl_power style 'low:high:step' -> (low, high, step) in Hz"""
+    lowfreq, highfreq, step = freqs.split(':')
+    return parse_freq(lowfreq), parse_freq(highfreq), parse_freq(step)
+
+
+class Baseline(object):
+    """Running average power for one sweep range, indexed by bin offset"""
+    def __init__(self, key=None):
+        self.key = key  # checkpoint identity, see baseline_key()
+        self.segments = dict()  # rtl_power line freq_low (Hz) -> (offset, nbins)
+        self.size = 0
+        self.mean = numpy.zeros(BASELINE_BINS, dtype=numpy.float32)
+        self.count = numpy.zeros(BASELINE_BINS, dtype=numpy.uint16)  # saturates at AVG_SAMPLES + 1
+
+    def segment(self, freq_low, nbins):
+        """Return (offset, is_new) for the bins of the line starting at freq_low
+
+        A line no wider than the one first seen at freq_low shares its bins;
+        a wider one gets None, since its bins can't be placed without
+        abandoning the averages already gathered.
+        """
+        start = int(round(freq_low))
+        if start in self.segments:
+            offset, known = self.segments[start]
+            if nbins <= known:
+                return offset, False
+            return
+
+        offset = self.size
+        self.size += nbins
+        if self.size > len(self.mean):
+            capacity = max(self.size, 2 * len(self.mean))
+            mean = numpy.zeros(capacity, dtype=numpy.float32)
+            mean[:offset] = self.mean[:offset]
+            count = numpy.zeros(capacity, dtype=numpy.uint16)
+            count[:offset] = self.count[:offset]
+            self.mean, self.count = mean, count
+
+        self.segments[start] = (offset, nbins)
+        return offset, True
+
+    def save(self, path):
+        """Checkpoint to path, atomically (write a temp file, then rename)"""
+        segments = numpy.array([(start, offset, nbins) for start, (offset, nbins) in self.segments.items()],
+                dtype=numpy.int64).reshape(-1, 3)
+
+        tmppath = path + '.tmp'
+        with open(tmppath, 'wb') as f:
+            f.write(CHECKPOINT_HEADER.pack(CHECKPOINT_MAGIC, time.time(), self.key, len(segments), self.size))
+            f.write(segments.tostring())
+            f.write(self.mean[:self.size].tostring())
+            f.write(self.count[:self.size].tostring())
+        os.rename(tmppath, path)
+
+    @classmethod
+    def load(cls, path, key):
+        """Map a checkpoint copy-on-write; None if missing, stale or not ours"""
+        try:
+            with open(path, 'rb') as f:
+                header = f.read(CHECKPOINT_HEADER.size)
+            magic, saved, savedkey, nsegments, size = CHECKPOINT_HEADER.unpack(header)
+        except (IOError, struct.error):
+            return
+
+        offset = CHECKPOINT_HEADER.size + nsegments * 3 * 8
+        expected = offset + size * (4 + 2)
+        if magic != CHECKPOINT_MAGIC or savedkey.rstrip('\0') != key or \
+                time.time() - saved > CHECKPOINT_MAX_AGE or os.path.getsize(path) != expected or not size:
+            print("[scanner] Discarding stale or mismatched baseline checkpoint {}".format(path))
+            os.unlink(path)
+            return
+
+        baseline = cls(key)
+        segments = numpy.memmap(path, dtype=numpy.int64, mode='r', offset=CHECKPOINT_HEADER.size, shape=(nsegments, 3))
+        baseline.segments = dict((int(start), (int(off), int(nbins))) for start, off, nbins in segments)
+        baseline.size = size
+        baseline.mean = numpy.memmap(path, dtype=numpy.float32, mode='c', offset=offset, shape=(size,))
+        baseline.count = numpy.memmap(path, dtype=numpy.uint16, mode='c', offset=offset + size * 4, shape=(size,))
+        return baseline
+
+
+def cluster_hits(hot, pwrs, mean):
+    """Merge runs of adjacent hit bins into emissions
+
+    Returns (peak bin, width in bins, mean dB over the average) per run.
+    """
+    hotidx = numpy.flatnonzero(hot)
+    if not len(hotidx):
+        return hotidx, hotidx, numpy.zeros(0)
+
+    runid = numpy.cumsum(numpy.diff(numpy.concatenate(([-2], hotidx))) != 1) - 1
+    widths = numpy.bincount(runid)
+    excesses = numpy.bincount(runid, weights=pwrs[hotidx] - mean[hotidx]) / widths
+
+    order = numpy.lexsort((pwrs[hotidx], runid))  # by run, strongest bin last
+    peaks = hotidx[order[numpy.cumsum(widths) - 1]]
+
+    return peaks, widths, excesses
+
+
+def baseline_key(serial, engine, freqrange):
+    """Checkpoint identity: same device, sweep engine, range and step"""
+    serial = ''.join(c for c in serial if c.isalnum())[:16]  # key must fit the checkpoint header
+    return "{}_{}_{}_{}_{}".format(serial, engine, *freqrange)
+
+
+def baseline_path(dirname, key):
+    return os.path.join(dirname, "scanner_{}.base".format(key))
+
+
+class TokenBucket(object):
+    """Non-blocking rate limiter: 'rate' tokens/sec, at most 'burst' banked"""
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.stamp = time.time()
+
+    def take(self):
+        now = time.time()
+        self.tokens = min(self.burst, self.tokens + (now - self.stamp) * self.rate)
+        self.stamp = now
+
+        if self.tokens < 1:
+            return False
+        self.tokens -= 1
+        return True
+
+
 class Reporter(Process):
     def __init__(self, reporter_opts, in_pipe, settings):
         self.station_id = reporter_opts['station_id']
@@ -60,69 +243,205 @@ class Reporter(Process):
         self.server_host = reporter_opts['server_host']
         self.server_port = reporter_opts['server_port']
         self.agf = reporter_opts['agf']
-        self.freqmap = dict()
+        self.baseline_dir = reporter_opts['baseline_dir']
+        self.baselines = dict()  # jobid -> Baseline
+        self.rings = dict()  # jobid -> (RingBuffer, gain)
         self.running = True
         self.socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
         self.in_pipe = in_pipe
+        self.shards = reporter_opts['shards']  # the node's hit rate and burst are split evenly across reporters
 
         self.settings = dict()
         for setting, default in settings.items():
             self.settings[setting] = default
 
+        self.bucket = TokenBucket(*self.shard_limits())
+        self.hits = OrderedDict()  # (jobid, freq) -> send_hit args, oldest first
+        self.coalesced = 0
+        self.hits_dropped = 0
+
         super(Reporter, self).__init__()
 
+    def shard_limits(self):
+        """(hit rate, burst) for this reporter's share of the node's limits"""
+        return self.settings['hit_rate'] / self.shards, max(self.settings['hit_burst'] / self.shards, 1)
+
     def run(self):
+        stats_start = time.time()
+        stats_bins = 0
+        checkpointed = stats_start
+        detached_drops = 0
+        reported_drops = 0
+
         while self.running:
-            (op, args) = self.in_pipe.recv()
+            busy = False
+            for jobid, (ring, gain) in self.rings.items():
+                for _ in range(RING_BATCH):
+                    row = ring.read()
+                    if row is None:
+                        break
+
+                    freq_low, step, ct, lat, lng, pwrs = row
+                    loc = {'lat': str(lat), 'lng': str(lng)}
+                    self.process_row(freq_low, step, pwrs, gain, loc, jobid, ct)
+                    ring.advance()
+
+                    stats_bins += len(pwrs)
+                    busy = True
+
+            while self.hits and self.bucket.take():
+                _, hit = self.hits.popitem(last=False)
+                self.send_hit(*hit)
+
+            if self.in_pipe.poll(0 if busy else REPORTER_POLL):
+                (op, args) = self.in_pipe.recv()
+
+                if op == "stop":
+                    self.running = False
+                    continue
 
-            if op == "stop":
-                self.running = False
-                continue
+                if op == "toggle":
+                    self.settings[args[0]] = args[1]
+                    self.bucket.rate, self.bucket.burst = self.shard_limits()
+                    continue
 
-            if op == "toggle":
-                self.settings[args[0]] = args[1]
-                continue
+                if op == "attach":
+                    jobid, path, gain, key = args
+                    try:
+                        ring = RingBuffer.attach(path)
+                        os.unlink(path)  # the mapping outlives the file
+                    except (IOError, OSError) as e:
+                        print("[scanner] Could not attach to scanner ring: {}".format(e))
+                        continue
+                    self.rings[jobid] = (ring, gain)
+
+                    baseline = None
+                    if self.baseline_dir:
+                        baseline = Baseline.load(baseline_path(self.baseline_dir, key), key)
+                        if baseline:
+                            print("[scanner] Resuming baseline {} ({} bins)".format(key, baseline.size))
+                    self.baselines[jobid] = baseline or Baseline(key)
+                    continue
 
-            freq, pwr, step, gain, loc, jobid, ct = args
-            try:
-                avg, count = self.freqmap[freq]
-            except KeyError:
-                self.freqmap[freq] = (pwr, 1)
-                continue
+                if op == "detach":
+                    jobid = args[0]
+                    if jobid in self.rings:
+                        ring, _ = self.rings.pop(jobid)
+                        detached_drops += ring.overflows()
+                        ring.close()
+                    if jobid in self.baselines:
+                        self.checkpoint(self.baselines.pop(jobid))
+                    continue
+
+            now = time.time()
+            if now - stats_start >= STATS_INTERVAL:
+                drops = detached_drops + sum(ring.overflows() for ring, _ in self.rings.values())
+                if drops != reported_drops:
+                    print("[scanner] Reporter falling behind, {} rows dropped so far".format(drops))
+                    reported_drops = drops
+
+                if self.settings['stats']:
+                    elapsed = now - stats_start
+                    print("[scanner] Reporter sustaining {:.0f} bins/sec; hits coalesced {:.1f}/sec, dropped {:.1f}/sec, {} queued".format(
+                        stats_bins / elapsed, self.coalesced / elapsed, self.hits_dropped / elapsed, len(self.hits)))
+                stats_start = now
+                stats_bins = 0
+                self.coalesced = 0
+                self.hits_dropped = 0
+
+            if now - checkpointed >= CHECKPOINT_INTERVAL:
+                for baseline in self.baselines.values():
+                    self.checkpoint(baseline)
+                checkpointed = now
+
+        for ring, _ in self.rings.values():
+            ring.close()
+
+        for baseline in self.baselines.values():
+            self.checkpoint(baseline)
+
+        return
 
-            threshold = avg + self.settings['hit_db']
+    def checkpoint(self, baseline):
+        if not self.baseline_dir or not baseline.key or not baseline.size:
+            return
 
-            if self.settings['print_all']:
-                print("[scanner] Freq: {}, Power: {}, Threshold: {}, Step: {}, Loc: {}, Count: {}, JobId: {}".format(freq, pwr, threshold, step, loc, count, jobid))
+        try:
+            baseline.save(baseline_path(self.baseline_dir, baseline.key))
+        except (IOError, OSError) as e:
+            print("[scanner] Could not checkpoint baseline {}: {}".format(baseline.key, e))
 
-            if pwr > threshold and (count > AVG_SAMPLES or count == "done"):
-                if self.settings['print_hits']:
-                    print("[scanner] Hit on {} ({} > {})".format(freq, pwr, threshold))
+    def process_row(self, freq_low, step, pwrs, gain, loc, jobid, ct):
+        baseline = self.baselines.get(jobid)
+        if not baseline:
+            baseline = self.baselines[jobid] = Baseline()
 
-                if self.settings['alert_on'] and \
-                        (freq > self.settings['alert_center'] - self.settings['alert_bw'] and freq < self.settings['alert_center'] + self.settings['alert_bw']):
-                            print("[scanner] ALERT: {} {} at {}".format(freq, pwr, time.strftime("%c")))
+        placed = baseline.segment(freq_low, len(pwrs))
+        if not placed:
+            return
+        offset, new = placed
+        mean = baseline.mean[offset:offset + len(pwrs)]
+        count = baseline.count[offset:offset + len(pwrs)]
+        if new:
+            mean[:] = pwrs
+            count[:] = 1
+            return
 
-                overpct = "{:.3f}".format(abs( ( (pwr - avg)/avg )*100 ))
-                self.send_hit(freq, pwr, overpct, step, gain, loc, jobid, ct)
-                time.sleep(REPORTER_SLEEP)
+        threshold = mean + self.settings['hit_db']
+
+        if self.settings['print_all']:
+            for i in range(len(pwrs)):
+                freq = int(round(freq_low + (step * i)))
+                print("[scanner] Freq: {}, Power: {}, Threshold: {}, Step: {}, Loc: {}, Count: {}, JobId: {}".format(freq, pwrs[i], threshold[i], step, loc, count[i], jobid))
+
+        peaks, widths, excesses = cluster_hits((pwrs > threshold) & (count > AVG_SAMPLES), pwrs, mean)
+        for i, width, excess in zip(peaks.tolist(), widths.tolist(), excesses.tolist()):
+            freq = int(round(freq_low + (step * i)))
+            pwr = float(pwrs[i])
+            avg = float(mean[i])
+            bw = width * step
+
+            if self.settings['print_hits']:
+                print("[scanner] Hit on {} ({} > {}, {} Hz wide)".format(freq, pwr, threshold[i], bw))
+
+            if self.settings['alert_on'] and \
+                    (freq > self.settings['alert_center'] - self.settings['alert_bw'] and freq < self.settings['alert_center'] + self.settings['alert_bw']):
+                        print("[scanner] ALERT: {} {} at {}".format(freq, pwr, time.strftime("%c")))
+
+            overpct = "{:.3f}".format(abs( ( (pwr - avg)/avg )*100 ))
+            self.queue_hit(freq, pwr, overpct, step, bw, excess, gain, loc, jobid, ct)
+
+        mean += (pwrs - mean) / AVG_SAMPLES
+        count[count <= AVG_SAMPLES] += 1
+
+    def queue_hit(self, freq, pwr, overpct, step, bw, excess, gain, loc, jobid, ct):
+        """Hold a hit for the rate limiter, keeping the strongest per bin"""
+        key = (jobid, freq)
+        if key in self.hits:
+            self.coalesced += 1
+            if self.hits[key][1] >= pwr:
+                return
+            self.hits[key] = (freq, pwr, overpct, step, bw, excess, gain, loc, jobid, ct)  # keeps its place in line
+            return
 
-            avg -= avg/AVG_SAMPLES
-            avg += pwr/AVG_SAMPLES
-            self.freqmap[freq] = (avg, count + 1 if (count != "done" and count < AVG_SAMPLES) else "done")
+        if len(self.hits) >= HIT_QUEUE_LEN:
+            self.hits.popitem(last=False)
+            self.hits_dropped += 1
 
-        return
+        self.hits[key] = (freq, pwr, overpct, step, bw, excess, gain, loc, jobid, ct)
 
-    def send_hit(self, freq, pwr, overpct, step, gain, loc, jobid, ct):
+    def send_hit(self, freq, pwr, overpct, step, bw, excess, gain, loc, jobid, ct):
         data = OrderedDict()
         data['stationid'] = self.station_id
         data['lat'] = loc['lat']
         data['lng'] = loc['lng']
         data['agf'] = str(self.agf)
         data['freq'] = str(freq)
-        data['pwr'] = str(pwr)
+        data['pwr'] = "{:.2f}".format(pwr)  # float32 readings, rtl_power precision
         data['overpct'] = str(overpct)
         data['step'] = str(step)
+        data['bw'] = str(bw)
+        data['excess'] = "{:.2f}".format(excess)
         data['gain'] = str(gain)
         data['module'] = 'scanner'
         data['jobid'] = jobid
@@ -138,9 +457,8 @@ class Reporter(Process):
 
 
 class Scanner(threading.Thread):
+    """Common plumbing for a sweep source feeding rows to the reporter"""
     def __init__(self, scanner_opts, reporter, reporter_pipe, gpsp, devmod):
-        global procs
-
         self.devnum = scanner_opts['devnum']
         self.reporter = reporter
         self.reporter_pipe = reporter_pipe
@@ -148,28 +466,90 @@ class Scanner(threading.Thread):
         self.devmod = devmod
         self.gain = scanner_opts['gain']
         self.uuid = scanner_opts['uuid']
+        self.recorder = scanner_opts['recorder']
+        self.baseline_key = scanner_opts['baseline_key']
+
+        self.ring = None  # see attach
+        self.ringlock = threading.Lock()  # rows may still be in flight when we're stopped
+
+        self.gpswarned = 0
+        self.stoprequest = threading.Event()
+        threading.Thread.__init__(self)
+
+    def current_loc(self, wait=True):
+        # look for gps here to avoid flooding the reporter in the case of no lock
+        loc = self.gpsp.get_current()
+        if (loc == None) or (loc['lat'] == "0.0" and loc['lng'] == "0.0") or (loc['lat'] == "NaN"):
+            if wait:
+                print("[scanner] No GPS loc, waiting...")
+                time.sleep(ERROR_SLEEP)
+            elif time.time() - self.gpswarned >= ERROR_SLEEP:
+                print("[scanner] No GPS loc, dropping readings...")
+                self.gpswarned = time.time()
+            return
+
+        return loc
+
+    def attach(self):
+        """Hand the reporter our ring; subclasses call this last in __init__,
+        once the device or child is open, so a failed open leaves nothing behind"""
+        self.ring = RingBuffer.create()
+        self.reporter_pipe.send( ("attach", (self.uuid, self.ring.path, self.gain, self.baseline_key) ) )
+
+    def emit_row(self, freq_low, step, pwrs, loc):
+        """Hand a row to the reporter; False if the ring was full (counted)"""
+        ct = int(round(time.time() * 1000))
+        written = False
+        with self.ringlock:
+            if self.ring:
+                written = self.ring.write(freq_low, step, ct, float(loc['lat']), float(loc['lng']), pwrs)
+
+        if self.recorder:
+            self.recorder.append(ct, freq_low, step, pwrs)
+
+        return written
+
+    def detach(self):
+        with self.ringlock:
+            if not self.ring:
+                return
+
+            try:
+                self.reporter_pipe.send( ("detach", (self.uuid,) ) )
+            except (IOError, OSError):  # reporter already gone (shutdown)
+                pass
+            self.ring.close(unlink=True)
+            self.ring = None
+
+        if self.recorder:
+            if self.recorder.dropped:
+                print("[scanner] Waterfall recorder for device {} dropped {} rows".format(self.devnum, self.recorder.dropped))
+            self.recorder.close()
+
+    def join(self, timeout=None):
+        self.stoprequest.set()
+        super(Scanner, self).join(timeout)
+        self.detach()
+
+
+class RtlPowerScanner(Scanner):
+    """Sweep source reading rtl_power's CSV output
+
+    Not a running thread of its own: lines arrive through the shared
+    ProcReader, see gammarf_procio.
+    """
+    def __init__(self, scanner_opts, reporter, reporter_pipe, gpsp, devmod):
+        global procs
+
+        super(RtlPowerScanner, self).__init__(scanner_opts, reporter, reporter_pipe, gpsp, devmod)
 
         cmd = scanner_opts['cmd']
-        freqs = scanner_opts['freqs']
+        lowfreq, highfreq, _ = scanner_opts['range']
+        width = scanner_opts['freqs'].split(':')[2]
         integration = scanner_opts['integration']
         ppm = scanner_opts['ppm']
 
-        try:
-            outfreqs = []
-            lowfreq, highfreq, width = freqs.split(':')
-            for f in [lowfreq, highfreq]:
-                if f[len(f)-1] == 'M':
-                    f = int(float(f[:len(f)-1])*1e6)
-                elif f[len(f)-1] == 'k':
-                    f = int(float(f[:len(f)-1])*1e3)
-                else:
-                    f = int(f)
-                outfreqs.append(f)
-        except Exception:
-            print("Error parsing frequency string")
-            return
-
-        fstr = "{}:{}:{}".format(str(outfreqs[0]), str(outfreqs[1]), width)
+        fstr = "{}:{}:{}".format(str(lowfreq), str(highfreq), width)
         ON_POSIX = 'posix' in builtin_module_names 
         self.cmdpipe = Popen([cmd, "-d {}".format(self.devnum), "-f {}".format(fstr),   #freqs
                 "-i {}".format(integration), "-p {}".format(ppm), "-g {}".format(self.gain),
@@ -177,67 +557,228 @@ class Scanner(threading.Thread):
                 stdout=PIPE, stderr=STDOUT, close_fds=ON_POSIX)
 
         procs.append(self.cmdpipe)
+        self.reader = get_reader()
+        self.attach()
 
-        self.stoprequest = threading.Event()
-        threading.Thread.__init__(self)
+    def start(self):
+        self.reader.add(self.cmdpipe, self.on_line, self.on_eof)
+
+    def on_line(self, raw):
+        if len(raw) == 0 or self.stoprequest.isSet():
+            return
+
+        if len(raw.split(' ')[0].split('-')) != 3:  # line irrelevant, or from stderr
+            if raw == "Error: dropped samples.":
+                print("[scanner] Error with device {}, exiting task".format(self.devnum))
+                self.devmod.removedev(self.devnum)
+                self.stop_child()
+            return
+
+        loc = self.current_loc(wait=False)
+        if not loc:
+            return
+
+        try:
+            header, pwrs = parse_rtl_power_line(raw)
+        except ValueError:
+            print("[scanner] Bad line from rtl_power on device {}, exiting task".format(self.devnum))
+            self.stop_child()
+            return
+
+        _, _, freq_low, _, step, _ = header
+        self.emit_row(freq_low, step, pwrs, loc)
+
+    def on_eof(self):
+        if not self.stoprequest.isSet():
+            print("[scanner] rtl_power on device {} exited (code {})".format(self.devnum, self.cmdpipe.wait()))
+        self.stop_child()
+
+    def stop_child(self):
+        global procs
+
+        self.stoprequest.set()
+        self.reader.remove(self.cmdpipe)
+
+        try:
+            procs.remove(self.cmdpipe)
+        except ValueError:  # already stopped (eof and join can race)
+            return
+
+        try:
+            self.cmdpipe.kill()
+        except OSError:  # already exited
+            pass
+        self.cmdpipe.wait()
+        self.cmdpipe.stdout.close()
+
+    def join(self, timeout=None):
+        self.stop_child()
+        self.detach()
+
+
+class SweepPlan(object):
+    """Hop geometry of an fft sweep: each hop keeps the spectrum less CROP,
+    and the next hop starts where the kept bins end"""
+    def __init__(self, step, rate=SWEEP_RATE):
+        # power-of-two fft no coarser than the requested step, like rtl_power
+        self.fft = SweepFFT(next_2_to_pow(int(math.ceil(rate / step))))
+        self.nfft = self.fft.nfft
+        self.rate = rate
+        self.binwidth = rate / self.nfft
+        self.crop = int(self.nfft * CROP / 200)  # bins dropped from each edge
+        self.hopwidth = (self.nfft - 2 * self.crop) * self.binwidth
+        self.numsamps = max(self.nfft * SWEEP_AVERAGES, 256)  # reads are whole 512-byte blocks
+
+    def center(self, hop_low):
+        """Tuning that puts hop_low at the first kept bin"""
+        return hop_low - self.crop * self.binwidth + self.nfft / 2 * self.binwidth
+
+    def hop_low(self, center):
+        return center - self.nfft / 2 * self.binwidth + self.crop * self.binwidth
+
+    def kept(self, pwrs, hop_low, highfreq=None):
+        """The bins of a hop's spectrum that are swept, up to highfreq"""
+        nbins = self.nfft - 2 * self.crop
+        if highfreq is not None:
+            nbins = min(nbins, int(math.ceil((highfreq - hop_low) / self.binwidth)))
+        return pwrs[self.crop:self.crop + nbins]
+
+
+class SweepScanner(Scanner):
+    """Sweep source driving the dongle in-process: hop, FFT, crop, emit"""
+    def __init__(self, scanner_opts, reporter, reporter_pipe, gpsp, devmod):
+        super(SweepScanner, self).__init__(scanner_opts, reporter, reporter_pipe, gpsp, devmod)
+
+        self.lowfreq, self.highfreq, step = scanner_opts['range']
+        self.plan = SweepPlan(step)
+
+        self.sdr = rtlsdr.RtlSdr(self.devnum)
+        self.sdr.set_sample_rate(SWEEP_RATE)
+        self.sdr.set_manual_gain_enabled(1)
+        self.sdr.set_gain(self.gain)
+
+        ppm = scanner_opts['ppm']
+        if ppm != 0:
+            self.sdr.freq_correction = ppm
+
+        # same reads and settling as a timeshare scan job, which shares our baselines
+        self.settle_buf = numpy.empty(2 * tuner_settle(self.sdr), dtype=numpy.uint8)  # reused, never looked at
+        self.raw = numpy.empty(2 * self.plan.numsamps, dtype=numpy.uint8)
+        self.samples = numpy.empty(self.plan.numsamps, dtype=numpy.complex64)
+
+        self.attach()
 
     def run(self):
         while not self.stoprequest.isSet():
-            data = self.cmdpipe.stdout.readline()
+            loc = self.current_loc()
+            if not loc:
+                continue
 
-            if len(data) == 0:
+            hop_low = self.lowfreq
+            while hop_low < self.highfreq and not self.stoprequest.isSet():
                 try:
-                    continue
-                except Exception:
+                    self.sdr.set_center_freq(self.plan.center(hop_low))
+                    if len(self.settle_buf):
+                        read_sync(self.sdr, self.settle_buf)
+                    read_sync(self.sdr, self.raw)
+                except IOError:
+                    print("[scanner] Error with device {}, exiting task".format(self.devnum))
+                    self.devmod.removedev(self.devnum)
+                    self.sdr.close()
                     return
 
-            # look for gps here to avoid flooding the reporter in the case of no lock
-            loc = self.gpsp.get_current()
-            if (loc == None) or (loc['lat'] == "0.0" and loc['lng'] == "0.0") or (loc['lat'] == "NaN"):
-                print("[scanner] No GPS loc, waiting...")
-                time.sleep(ERROR_SLEEP)
-                continue
+                pwrs = self.plan.fft.power(bytes_to_iq(self.raw, self.samples))
+                if pwrs is None:
+                    break
 
-            for raw in data.split('\n'):
-                if len(raw) == 0:
-                    continue
+                self.emit_row(hop_low, self.plan.binwidth, self.plan.kept(pwrs, hop_low, self.highfreq), loc)
+                hop_low += self.plan.hopwidth
 
-                if len(raw.split(' ')[0].split('-')) != 3:  # line irrelevant, or from stderr
-                    if raw == "Error: dropped samples.":
-                        print("[scanner] Error with device {}, exiting task".format(self.devnum))
-                        self.devmod.removedev(self.devnum)
-                        return
-                    continue
+        self.sdr.close()
+        return
 
-                try:
-                    _, _, freq_low, freq_high, step, _samples, raw_readings = raw.split(', ', 6)
-                    freq_low = float(freq_low)
-                    step = float(step)
 
-                    readings = [x.strip() for x in raw_readings.split(',')]
+class ReplayScanner(Scanner):
+    """Sweep source playing back recorded rtl_power CSV or waterfall files
+
+    scanner_opts['replay'] is a list of files, played in order;
+    scanner_opts['speed'] is the playback rate relative to the recording
+    (1 is real time), or 0 to go as fast as the reporter keeps up.
+    """
+    def __init__(self, scanner_opts, reporter, reporter_pipe, gpsp, devmod):
+        super(ReplayScanner, self).__init__(scanner_opts, reporter, reporter_pipe, gpsp, devmod)
+
+        self.paths = scanner_opts['replay']
+        self.speed = scanner_opts['speed']
+        self.rows = 0
+        self.bins = 0
+        self.attach()
+
+    def recorded_rows(self):
+        """(recorded time in s, freq_low, step, pwrs) from each file in turn"""
+        for path in self.paths:
+            if path.endswith('.wf') or path.endswith('.wf.gz'):
+                for ct, freq_low, step, pwrs in read_waterfall(path):
+                    yield ct / 1000, freq_low, step, pwrs
+                continue
+
+            with open(path) as f:
+                for raw in f:
+                    raw = raw.rstrip('\n')
+                    if len(raw.split(' ')[0].split('-')) != 3:
+                        continue
+
+                    try:
+                        header, pwrs = parse_rtl_power_line(raw)
+                        date, hms, freq_low, _, step, _ = header
+                        recorded = time.mktime(time.strptime("{} {}".format(date, hms), "%Y-%m-%d %H:%M:%S"))
+                    except ValueError:
+                        print("[scanner] Skipping bad line in {}".format(path))
+                        continue
+
+                    yield recorded, freq_low, step, pwrs
 
-                except:
-                    print("[scanner] Thread exiting on exception")
+    def run(self):
+        loc = self.current_loc()
+        while not loc and not self.stoprequest.isSet():
+            loc = self.current_loc()
+
+        started = time.time()
+        first = None
+        for recorded, freq_low, step, pwrs in self.recorded_rows():
+            if self.stoprequest.isSet():
+                break
+
+            if self.speed:
+                if first is None:
+                    first = recorded
+                delay = started + (recorded - first) / self.speed - time.time()
+                if delay > 0:
+                    self.stoprequest.wait(delay)
+
+            # rows are the experiment here, so wait for room rather than drop
+            while not self.emit_row(freq_low, step, pwrs, loc) and not self.speed:
+                if self.stoprequest.wait(REPORTER_POLL) or not self.ring:
                     return
 
-                ct = int(round(time.time() * 1000))
-                for i in range(len(readings)):
-                    freq = int(round(freq_low + (step * i)))
-                    pwr = float(readings[i])
-                    self.reporter_pipe.send( ("data", (freq, pwr, step, self.gain, loc, self.uuid, ct) ) )
+            self.rows += 1
+            self.bins += len(pwrs)
 
-        self.cmdpipe.stdout.close()
-        self.cmdpipe.kill()
-        os.kill(self.cmdpipe.pid, 9)
-        os.wait()
-        
-        procs.remove(self.cmdpipe)
+        return
+
+
+class CaptureScanner(Scanner):
+    """Sweep source whose rows are pushed in from another module's device thread"""
+    def __init__(self, scanner_opts, reporter, reporter_pipe, gpsp, devmod):
+        super(CaptureScanner, self).__init__(scanner_opts, reporter, reporter_pipe, gpsp, devmod)
+        self.attach()
 
+    def start(self):
         return
 
     def join(self, timeout=None):
         self.stoprequest.set()
-        super(Scanner, self).join(timeout)
+        self.detach()
 
 
 class GrfModuleScanner(GrfModuleBase):
@@ -246,24 +787,58 @@ class GrfModuleScanner(GrfModuleBase):
         if not isinstance(rtl_path, str) or not rtl_path:
             raise Exception("param 'rtl_path' not appropriately defined in config")
 
+        engine = config.scanner.engine
+        if not isinstance(engine, str) or not engine:
+            engine = DEFAULT_ENGINE
+        if engine not in ENGINES:
+            raise Exception("param 'engine' must be one of: {}".format(", ".join(ENGINES)))
+
+        if engine == 'native' and not rtlsdr:
+            raise Exception("native engine requires pyrtlsdr")
+
         command = rtl_path + '/' + 'rtl_power'
-        if not os.path.isfile(command) or not os.access(command, os.X_OK):
+        if engine == 'rtl_power' and (not os.path.isfile(command) or not os.access(command, os.X_OK)):
             raise Exception("executable rtl_power not found in specified path")
 
+        baseline_dir = config.scanner.baseline_dir
+        if not isinstance(baseline_dir, str) or not baseline_dir:
+            baseline_dir = None  # no checkpoints
+        elif not os.path.isdir(baseline_dir):
+            os.makedirs(baseline_dir)
+
+        waterfall_dir = config.scanner.waterfall_dir
+        if not isinstance(waterfall_dir, str) or not waterfall_dir:
+            waterfall_dir = DEFAULT_WATERFALL_DIR
+
+        compress = config.scanner.waterfall_compress
+        self.waterfall_compress = isinstance(compress, str) and compress.strip() not in ('', '0')
+
         self.config = config
         self.cmd = command
+        self.baseline_dir = baseline_dir
+        self.waterfall_dir = waterfall_dir
         self.integration = INTEGRATION_INTERVAL
         self.agf = None
         self.scanners = list()
-        self.reporter = None
-        self.reporter_pipe = None
+        self.reporters = list()  # (Reporter, pipe), one per shard
+
+        numreporters = config.scanner.reporters
+        if isinstance(numreporters, str) and numreporters:
+            self.numreporters = max(1, int(numreporters))
+        else:
+            self.numreporters = DEFAULT_REPORTERS
 
         self.settings = {'print_all': False,
                 'print_hits': False,
                 'hit_db': DEFAULT_HIT_DB,
                 'alert_on': False,
                 'alert_center': 0.0,
-                'alert_bw': 5000.0}
+                'alert_bw': 5000.0,
+                'engine': engine,
+                'hit_burst': DEFAULT_HIT_BURST,
+                'hit_rate': DEFAULT_HIT_RATE,
+                'record': False,
+                'stats': False}
 
         print("Loading {}".format(MODULE_DESCRIPTION))
 
@@ -275,67 +850,139 @@ class GrfModuleScanner(GrfModuleBase):
         print("\tExample: > run scanner 0 200M:300M:15k")
         print("")
         print("\tSettings:")
+        print("\t\tengine: Sweep with 'rtl_power', or 'native' to drive the device in-process (applies to new scanners)")
         print("\t\talert_x: Print an alert when there's a hit in a limited bandwidth around a specific frequency")
         print("\t\tprint_all: Print all readings")
         print("\t\tprint_hits: Print hits")
         print("\t\thit_db: Power is required to be this high above the average (dB) to be considered a hit")
+        print("\t\thit_rate, hit_burst: Hits/sec sent to the backend, and how many may go out at once; excess hits are queued and coalesced")
+        print("\t\trecord: Record every sweep row to a waterfall file in waterfall_dir (applies to new scanners)")
+        print("\t\tstats: Periodically print the number of bins/sec the reporter sustains")
         return True
 
     def run(self, devnum, freqs, system_params, loadedmods, remotetask=False):
         self.remotetask = remotetask
 
         devmod = loadedmods['devices']
-
-        if not self.agf:
-            self.agf = devmod.get_agf()
-
-        # these things are done only once
-        if not self.reporter:  # don't do in init -- what if the module's never used?
-            reporter_opts = {'station_id': system_params['station_id'],
-                    'server_host': system_params['server_host'],
-                    'server_port': system_params['server_port'],
-                    'station_pass': system_params['station_pass'],
-                    'agf': self.agf}
-
-            self.gpsworker = loadedmods['location'].gps_worker
-            self.reporter_pipe, child_pipe = Pipe()
-            reporter = Reporter(reporter_opts, child_pipe, self.settings)
-            reporter.start()
-            self.reporter = reporter
-
+        self.start_reporters(system_params, loadedmods)
 
         if not freqs:
             print("Must include a frequency specification")
             return
         freqs = freqs.strip()
-        if len(freqs.split(':')) != 3:
+        try:
+            freqrange = parse_range(freqs)
+        except (ValueError, IndexError):
             print("Bad frequency specification")
             return
 
-        stickgain = eval("self.config.scanner.gain{}".format(devnum))
-        if isinstance(stickgain, str):
-            gain = float(stickgain)
-        else:
-            gain = DEFAULT_GAIN
+        if freqrange[0] >= freqrange[1] or freqrange[2] <= 0:
+            print("Bad frequency specification")
+            return
+
+        if self.settings['engine'] not in ENGINES:
+            print("Unknown engine '{}', use one of: {}".format(self.settings['engine'], ", ".join(ENGINES)))
+            return
+
+        if self.settings['engine'] == 'rtl_power' and not os.access(self.cmd, os.X_OK):
+            print("rtl_power not available, use the native engine")
+            return
+
+        if self.settings['engine'] == 'native' and not rtlsdr:
+            print("pyrtlsdr not available, use the rtl_power engine")
+            return
+
+        gain = self.device_gain(devnum)
 
         scanner_opts = {'cmd': self.cmd,
                 'devnum': devnum,
                 'freqs': freqs,
+                'range': freqrange,
                 'integration': self.integration,
                 'ppm': devmod.get_ppm(devnum),
                 'gain': gain,
-                'uuid': str(uuid4())}
+                'uuid': str(uuid4()),
+                'baseline_key': baseline_key(devmod.get_serial(devnum) or "dev{}".format(devnum),
+                    self.settings['engine'], freqrange),
+                'recorder': None}
+
+        reporter, reporter_pipe = self.reporters[devnum % len(self.reporters)]  # shard by device
+        if self.settings['engine'] == 'native':
+            scanner = SweepScanner(scanner_opts, reporter, reporter_pipe, self.gpsworker, devmod)
+        else:
+            scanner = RtlPowerScanner(scanner_opts, reporter, reporter_pipe, self.gpsworker, devmod)
+
+        if self.settings['record']:  # only once the device is open, like the ring
+            if not os.path.isdir(self.waterfall_dir):
+                os.makedirs(self.waterfall_dir)
+            scanner.recorder = WaterfallWriter(self.waterfall_dir, scanner_opts['baseline_key'], self.waterfall_compress)
+            scanner.recorder.start()
 
-        scanner = Scanner(scanner_opts, self.reporter, self.reporter_pipe, self.gpsworker, devmod)
         scanner.daemon = True
         scanner.start()
         self.scanners.append( (devnum, scanner) )
 
         print("Scanner added on device {}".format(devnum))
         print("NOTE: It takes awhile to gather samples to form an average, for new frequency ranges")
+        if self.baseline_dir:
+            print("      (baselines are checkpointed to '{}' and resumed on restart)".format(self.baseline_dir))
+        if scanner.recorder:
+            print("Recording sweeps to '{}'".format(self.waterfall_dir))
 
         return True
 
+    def start_reporters(self, system_params, loadedmods):
+        devmod = loadedmods['devices']
+
+        if not self.agf:
+            self.agf = devmod.get_agf()
+
+        # these things are done only once
+        if not self.reporters:  # don't do in init -- what if the module's never used?
+            reporter_opts = {'station_id': system_params['station_id'],
+                    'server_host': system_params['server_host'],
+                    'server_port': system_params['server_port'],
+                    'station_pass': system_params['station_pass'],
+                    'agf': self.agf,
+                    'shards': self.numreporters,
+                    'baseline_dir': self.baseline_dir}
+
+            self.gpsworker = loadedmods['location'].gps_worker
+            for _ in range(self.numreporters):
+                reporter_pipe, child_pipe = Pipe()
+                reporter = Reporter(reporter_opts, child_pipe, self.settings)
+                reporter.start()
+                self.reporters.append( (reporter, reporter_pipe) )
+
+    def device_gain(self, devnum):
+        stickgain = eval("self.config.scanner.gain{}".format(devnum))
+        if isinstance(stickgain, str):
+            return float(stickgain)
+        return DEFAULT_GAIN
+
+    def attach_capture(self, devnum, freqrange, gain, system_params, loadedmods, engine='capture'):
+        """A sweep source for another module (gammarf_capture, gammarf_timeshare) to push rows into"""
+        devmod = loadedmods['devices']
+        self.start_reporters(system_params, loadedmods)
+
+        scanner_opts = {'devnum': devnum,
+                'gain': gain,
+                'uuid': str(uuid4()),
+                'baseline_key': baseline_key(devmod.get_serial(devnum) or "dev{}".format(devnum), engine, freqrange),
+                'recorder': None}
+
+        reporter, reporter_pipe = self.reporters[devnum % len(self.reporters)]
+        scanner = CaptureScanner(scanner_opts, reporter, reporter_pipe, self.gpsworker, devmod)
+        self.scanners.append( (devnum, scanner) )
+        return scanner
+
+    def detach_capture(self, scanner):
+        for entry in self.scanners:
+            if entry[1] is scanner:
+                scanner.join(THREAD_TIMEOUT)
+                self.scanners.remove(entry)
+                return
+
     def report(self):
         return
 
@@ -346,16 +993,17 @@ class GrfModuleScanner(GrfModuleBase):
         global procs
 
         print("Shutting down scanner module(s)")
-        try:  # if no module is running, this will cause an error
-            self.reporter_pipe.send( ("stop", (None) ) )
-            self.reporter.join()
-        except:
-            pass
-
         for scanner in self.scanners:
             devnum, thread = scanner
             thread.join(THREAD_TIMEOUT)
 
+        for reporter, reporter_pipe in self.reporters:  # after the scanners, so their detaches are seen
+            try:
+                reporter_pipe.send( ("stop", (None) ) )
+                reporter.join()
+            except:
+                pass
+
         for proc in procs:  # done b/c rtl_power keeps running in certain circumstances (low step sz)
             try:
                 proc.stdout.close()
@@ -371,7 +1019,7 @@ class GrfModuleScanner(GrfModuleBase):
         return
 
     def setting(self, setting, arg=None):
-        if not self.reporter_pipe:
+        if not self.reporters:
             print("Module not ready")
             return True
 
@@ -400,7 +1048,8 @@ class GrfModuleScanner(GrfModuleBase):
                 new = arg
 
         self.settings[setting] = new
-        self.reporter_pipe.send( ("toggle", (setting, new) ) )
+        for _, reporter_pipe in self.reporters:
+            reporter_pipe.send( ("toggle", (setting, new) ) )
 
         return True
 
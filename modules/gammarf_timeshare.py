@@ -0,0 +1,519 @@
+#!/usr/bin/env python2
+# gammarf timeshare module v0.1
+#
+# Joshua Davis (gammarf -*- covert.codes)
+# http://gammarf.io
+# Copyright(C) 2016
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+# Several scanner and freqwatch jobs on one dongle.  The device thread
+# gives the dongle to one job at a time for a slice of whole steps (a
+# sweep hop, or a freqwatch capture), so each job's retunes stay batched
+# together; the next slice goes to the ready job furthest behind its
+# share.  Rows go to the scanner module's reporter, readings to the
+# server as freqwatch sends them.
+
+from __future__ import division
+
+import abc
+import numpy
+import rtlsdr
+import threading
+import time
+from uuid import uuid4
+
+from gammarf_base import GrfModuleBase
+from gammarf_dsp import BinPowerEstimator, bytes_to_iq, next_2_to_pow
+from gammarf_freqwatch import DWELL, NFFT, SAMPLE_RATE, ReadingSender, RevisitScheduler, plan_windows, read_sync, tuner_settle
+from gammarf_scanner import SweepPlan, parse_range
+
+DEFAULT_SLICE = 0.5  # s; longer slices mean fewer switches between jobs' bands
+ERROR_SLEEP = 3  # s
+IDLE_SLEEP = 0.05  # s, when no job has work
+JOB_KINDS = ('scan', 'watch')
+MODULE_DESCRIPTION = "timeshare module"
+STATS_INTERVAL = 30  # s
+THREAD_TIMEOUT = 5
+
+
+def start(config):
+    return GrfModuleTimeshare(config)
+
+
+class Job(object):
+    """One user of a shared device; the device thread calls step() while it's this job's turn"""
+    __metaclass__ = abc.ABCMeta
+
+    def __init__(self, share, gain):
+        self.share = share
+        self.gain = gain
+        self.joined = time.time()
+        self.held = 0.0  # s with the device
+        self.overhead = 0.0  # s of that spent retuning and settling
+        self.retunes = 0
+        self.turns = 0
+        self.vtime = 0.0  # held / share; the lowest goes next
+        self.idle = False
+
+    @abc.abstractmethod
+    def describe(self):
+        return
+
+    @abc.abstractmethod
+    def ready(self, now):
+        """True if the job has work for the device"""
+        return
+
+    @abc.abstractmethod
+    def step(self, dev):
+        """One tune and read on dev, and what's done with it"""
+        return
+
+    def finish(self):
+        return
+
+    def stats(self, now):
+        """(achieved duty, retune overhead) as fractions"""
+        duty = self.held / (now - self.joined) if now > self.joined else 0.0
+        overhead = self.overhead / self.held if self.held else 0.0
+        return duty, overhead
+
+
+class ScanJob(Job):
+    """The scanner's native sweep, with rows pushed to its reporter"""
+    def __init__(self, share, gain, freqrange, scanmod):
+        super(ScanJob, self).__init__(share, gain)
+
+        self.lowfreq, self.highfreq, step = freqrange
+        self.plan = SweepPlan(step, SAMPLE_RATE)
+        self.raw = numpy.empty(2 * self.plan.numsamps, dtype=numpy.uint8)
+        self.samples = numpy.empty(self.plan.numsamps, dtype=numpy.complex64)
+        self.hop_low = self.lowfreq  # sweeps resume where the last slice left off
+        self.freqrange = freqrange
+        self.scanmod = scanmod
+        self.source = None  # see GrfModuleScanner.attach_capture
+        self.loc = None
+
+    def describe(self):
+        return "scan {}:{}:{}".format(*self.freqrange)
+
+    def ready(self, now):
+        self.loc = self.source.current_loc(wait=False)
+        return self.loc is not None
+
+    def step(self, dev):
+        dev.tune(self.plan.center(self.hop_low), self.gain)
+        dev.read(self.raw)
+
+        pwrs = self.plan.fft.power(bytes_to_iq(self.raw, self.samples))
+        self.source.emit_row(self.hop_low, self.plan.binwidth, self.plan.kept(pwrs, self.hop_low, self.highfreq), self.loc)
+
+        self.hop_low += self.plan.hopwidth
+        if self.hop_low >= self.highfreq:
+            self.hop_low = self.lowfreq
+
+    def finish(self):
+        self.scanmod.detach_capture(self.source)
+
+
+class WatchJob(Job):
+    """Freqwatch: capture windows when they're due, report their targets' power"""
+    def __init__(self, share, gain, freqlist, priorities, settings, sender, gpsp):
+        super(WatchJob, self).__init__(share, gain)
+
+        plan = plan_windows(freqlist)
+        self.windows = [(center, freqs, BinPowerEstimator(NFFT, SAMPLE_RATE, [f - center for f in freqs], numpy.complex64))
+                for center, freqs in plan]
+        self.scheduler = RevisitScheduler(plan, priorities, settings)
+
+        numsamps = next_2_to_pow(int(DWELL * SAMPLE_RATE))
+        self.raw = numpy.empty(2 * numsamps, dtype=numpy.uint8)
+        self.samples = numpy.empty(numsamps, dtype=numpy.complex64)
+        self.freqlist = freqlist
+        self.sender = sender
+        self.gpsp = gpsp
+        self.loc = None
+        self.gpswarned = 0
+
+    def describe(self):
+        return "watch {} frequencies in {} captures".format(len(set(self.freqlist)), len(self.windows))
+
+    def ready(self, now):
+        loc = self.gpsp.get_current()
+        if (loc == None) or (loc['lat'] == "0.0" and loc['lng'] == "0.0") or (loc['lat'] == "NaN"):
+            if now - self.gpswarned >= ERROR_SLEEP:
+                print("[timeshare] No GPS loc, watch waiting...")
+                self.gpswarned = now
+            return False
+
+        self.loc = loc
+        return self.scheduler.next(now, fill=False)[0] is not None  # the device's idle time is the scanner's
+
+    def step(self, dev):
+        index, _ = self.scheduler.next(time.time(), dev.center, False)  # due windows nearest the current tuning first
+        if index is None:
+            return
+
+        center, freqs, estimator = self.windows[index]
+        nbytes = 2 * max(next_2_to_pow(int(len(self.samples) * self.scheduler.dwell[index])), NFFT)
+        dev.tune(center, self.gain)
+        dev.read(self.raw[:nbytes])
+        self.scheduler.captured(index, time.time())
+
+        pwrs = estimator.power(bytes_to_iq(self.raw[:nbytes], self.samples[:nbytes // 2]))
+        self.scheduler.observe(index, pwrs)
+        for freq, pwr in zip(freqs, pwrs):
+            if not self.sender.send(freq, pwr, self.loc):
+                print("[timeshare] Could not send to server, dropping reading")
+
+    def finish(self):
+        self.sender.close()
+
+
+class SharedDevice(threading.Thread):
+    """Owns one dongle and hands it to its jobs in turn (stride scheduling)
+
+    A job that had nothing to do rejoins level with the busy jobs, rather
+    than with the turns it banked while idle.
+    """
+    def __init__(self, devnum, ppm, devmod, settings):
+        self.devnum = devnum
+        self.devmod = devmod
+        self.settings = settings
+
+        self.sdr = rtlsdr.RtlSdr(devnum)
+        self.sdr.set_sample_rate(SAMPLE_RATE)
+        self.sdr.set_manual_gain_enabled(1)
+        if ppm != 0:
+            self.sdr.freq_correction = ppm
+
+        self.settle_buf = numpy.empty(2 * tuner_settle(self.sdr), dtype=numpy.uint8)  # reused, never looked at
+
+        self.center = None
+        self.gain = None
+        self.current = None
+        self.jobs = list()
+        self.lock = threading.Lock()
+        self.stoprequest = threading.Event()
+        threading.Thread.__init__(self)
+
+    def add(self, job):
+        with self.lock:
+            if self.jobs:
+                job.vtime = min(j.vtime for j in self.jobs)
+            self.jobs.append(job)
+
+    def remove(self, job):
+        with self.lock:
+            self.jobs.remove(job)
+
+        while self.current is job and self.is_alive():  # let its slice finish
+            time.sleep(IDLE_SLEEP)
+        job.finish()
+
+    def pick(self, now):
+        with self.lock:
+            jobs = list(self.jobs)
+
+        ready = list()
+        for job in jobs:
+            if job.ready(now):
+                ready.append(job)
+            else:
+                job.idle = True
+
+        if not ready:
+            return
+
+        busy = [job.vtime for job in ready if not job.idle]
+        for job in ready:
+            if job.idle and busy:
+                job.vtime = max(job.vtime, min(busy))
+            job.idle = False
+
+        return min(ready, key=lambda job: job.vtime)
+
+    def run(self):
+        stats_start = time.time()
+        while not self.stoprequest.isSet():
+            now = time.time()
+            if self.settings['stats'] and now - stats_start >= STATS_INTERVAL:
+                self.print_stats()
+                stats_start = now
+
+            job = self.pick(now)
+            if not job:
+                self.stoprequest.wait(IDLE_SLEEP)
+                continue
+
+            with self.lock:
+                if job not in self.jobs:  # dropped meanwhile
+                    continue
+                self.current = job
+            job.turns += 1
+            started = time.time()
+            end = started + self.settings['slice']
+            try:
+                while True:
+                    job.step(self)
+                    now = time.time()
+                    if now >= end or self.stoprequest.isSet() or not job.ready(now):
+                        break
+            except IOError:
+                print("[timeshare] Error with device {}, exiting task".format(self.devnum))
+                self.devmod.removedev(self.devnum)
+                self.current = None
+                break
+
+            held = time.time() - started
+            job.held += held
+            job.vtime += held / job.share
+            self.current = None
+
+        self.sdr.close()
+        return
+
+    def tune(self, center, gain):
+        """Retune for the current job, charging it the time and the settling"""
+        if center == self.center and gain == self.gain:
+            return
+
+        started = time.time()
+        if gain != self.gain:
+            self.sdr.set_gain(gain)
+            self.gain = gain
+        self.sdr.set_center_freq(center)
+        self.center = center
+        if len(self.settle_buf):
+            self.read(self.settle_buf)
+
+        self.current.overhead += time.time() - started
+        self.current.retunes += 1
+
+    def read(self, buf):
+        read_sync(self.sdr, buf)
+
+    def print_stats(self):
+        now = time.time()
+        with self.lock:
+            jobs = list(self.jobs)
+
+        total = sum(job.share for job in jobs)
+        for num, job in enumerate(jobs):
+            duty, overhead = job.stats(now)
+            print("[timeshare] Device {}, job {} ({}): duty {:.0f}% (share {:.0f}%), retune overhead {:.0f}% ({} retunes, {} turns)".format(
+                self.devnum, num, job.describe(), duty * 100, job.share / total * 100, overhead * 100, job.retunes, job.turns))
+
+    def join(self, timeout=None):
+        self.stoprequest.set()
+        super(SharedDevice, self).join(timeout)
+
+        with self.lock:
+            jobs, self.jobs = self.jobs, list()
+        for job in jobs:
+            job.finish()
+
+
+class GrfModuleTimeshare(GrfModuleBase):
+    def __init__(self, config):
+        self.devices = dict()  # devnum -> SharedDevice
+        self.remotetask = False
+
+        self.settings = {'slice': DEFAULT_SLICE,
+                'stats': False}
+
+        print("Loading {}".format(MODULE_DESCRIPTION))
+
+    def help(self):
+        print("Timeshare: Run scanner and freqwatch jobs on one device, taking turns")
+        print("")
+        print("Usage: timeshare rtl_devnum scan[:share] freqs")
+        print("       timeshare rtl_devnum watch[:share] freq1 ... freqn (or a freqwatch set)")
+        print("\tRun again on the same device to add jobs; share is a job's relative weight (default 1)")
+        print("\tExample: > run timeshare 0 scan:3 88M:108M:10k")
+        print("\t         > run timeshare 0 watch set0")
+        print("\t         > run timeshare 0 drop 1")
+        print("")
+        print("\tSettings:")
+        print("\t\tslice: Seconds a job keeps the device per turn; longer batches more of its retunes together")
+        print("\t\tstats: Periodically print each job's achieved duty cycle and retune overhead (also in 'info')")
+        return True
+
+    def run(self, devnum, cmdline, system_params, loadedmods, remotetask=False):
+        self.remotetask = remotetask
+
+        args = cmdline.split(None, 1) if cmdline else []
+        if not args:
+            print("Must include a job: scan or watch")
+            return
+
+        kind, _, share = args[0].partition(':')
+        rest = args[1] if len(args) > 1 else None
+        dev = self.devices.get(devnum)
+
+        if kind == 'drop':
+            if dev:
+                self.drop(dev, rest)
+            return
+
+        if kind not in JOB_KINDS:
+            print("Jobs are one of: {}".format(", ".join(JOB_KINDS)))
+            return
+
+        try:
+            share = float(share) if share else 1.0
+        except ValueError:
+            share = 0
+        if share <= 0:
+            print("Share must be a positive number")
+            return
+
+        if kind == 'scan':
+            job = self.scan_job(devnum, share, rest, system_params, loadedmods)
+        else:
+            job = self.watch_job(share, rest, system_params, loadedmods)
+
+        if not job:
+            return
+
+        started = False
+        if not dev:
+            devmod = loadedmods['devices']
+            try:
+                dev = SharedDevice(devnum, devmod.get_ppm(devnum), devmod, self.settings)
+            except Exception:  # don't leave the job's sweep source attached, or its socket open
+                job.finish()
+                raise
+            dev.daemon = True
+            self.devices[devnum] = dev
+            started = True
+
+        dev.add(job)
+        if started:
+            dev.start()
+
+        print("Job {} on device {}: {}".format(len(dev.jobs) - 1, devnum, job.describe()))
+        return started  # later jobs join a device the first one occupied
+
+    def scan_job(self, devnum, share, freqs, system_params, loadedmods):
+        if 'scanner' not in loadedmods:
+            print("Scan jobs need the scanner module")
+            return
+
+        try:
+            freqrange = parse_range(freqs.strip())
+        except (AttributeError, ValueError, IndexError):
+            print("Bad frequency specification")
+            return
+
+        if freqrange[0] >= freqrange[1] or freqrange[2] <= 0:
+            print("Bad frequency specification")
+            return
+
+        scanmod = loadedmods['scanner']
+        gain = scanmod.device_gain(devnum)
+        job = ScanJob(share, gain, freqrange, scanmod)
+        job.source = scanmod.attach_capture(devnum, freqrange, gain, system_params, loadedmods, 'native')
+        return job
+
+    def watch_job(self, share, freqs, system_params, loadedmods):
+        if 'freqwatch' not in loadedmods:
+            print("Watch jobs need the freqwatch module")
+            return
+
+        fwmod = loadedmods['freqwatch']
+        targets = fwmod.parse_targets(freqs)
+        if not targets:
+            return
+        freqlist, priorities = targets
+
+        sender = ReadingSender(system_params, str(uuid4()), fwmod.settings, 'timeshare')
+        return WatchJob(share, fwmod.settings['gain'], freqlist, priorities, fwmod.settings, sender,
+                loadedmods['location'].gps_worker)
+
+    def drop(self, dev, num):
+        try:
+            job = dev.jobs[int(num)]
+        except (TypeError, ValueError, IndexError):
+            print("No such job; see 'info' for job numbers")
+            return
+
+        if len(dev.jobs) == 1:
+            print("That's the device's last job; stop the device instead")
+            return
+
+        dev.remove(job)
+        print("Dropped job: {}".format(job.describe()))
+
+    def report(self):
+        return
+
+    def info(self):
+        for dev in self.devices.values():
+            dev.print_stats()
+
+    def shutdown(self):
+        print("Shutting down timeshare module(s)")
+        for dev in self.devices.values():
+            dev.join(THREAD_TIMEOUT)
+        self.devices = dict()
+
+        return
+
+    def showconfig(self):
+        return
+
+    def setting(self, setting, arg=None):
+        if setting == None:
+            for setting, state in self.settings.items():
+                print("{}: {} ({})".format(setting, state, type(state)))
+            return True
+
+        if setting == 0:
+            return self.settings.keys()
+
+        if setting not in self.settings.keys():
+            return False
+
+        if isinstance(self.settings[setting], bool):
+            new = not self.settings[setting]
+        elif not arg:
+            print("Non-boolean setting requires an argument")
+            return True
+        else:
+            if isinstance(self.settings[setting], int):
+                new = int(arg)
+            elif isinstance(self.settings[setting], float):
+                new = float(arg)
+            else:
+                new = arg
+
+        self.settings[setting] = new
+
+        return True
+
+    def stop(self, devnum, devmod):
+        dev = self.devices.pop(devnum, None)
+        if not dev:
+            return False
+
+        dev.join(THREAD_TIMEOUT)
+        if not self.remotetask:
+            devmod.freedev(devnum)
+
+        return True
+
+    def ispseudo(self):
+        return False
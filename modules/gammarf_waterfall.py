@@ -0,0 +1,190 @@
+#!/usr/bin/env python2
+# gammarf waterfall recorder v0.1
+#
+# Joshua Davis (gammarf -*- covert.codes)
+# http://gammarf.io
+# Copyright(C) 2016
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+# Chunk layout: a 64 byte header, then fixed-size columns for 'capacity'
+# rows -- ct (int64 ms), freq_low (float64), step (float64), nbins
+# (int32), then a capacity x width block of powers.  Rows narrower than
+# the chunk are NaN padded; a wider row starts a new, wider chunk.
+# 'nrows' in the header is bumped after each row so a chunk being
+# written can be read.
+
+import errno
+import gzip
+import mmap
+import numpy
+import os
+import Queue
+import shutil
+import struct
+import threading
+import time
+
+CHUNK_ROWS = 16384  # rows per chunk file before rotating
+DATA_OFF = 64
+HEADER = struct.Struct('<8sIIII')  # magic, width, capacity, nrows, power itemsize
+MAGIC = 'GRFWF001'
+NROWS_OFF = 16
+POWER_DTYPE = numpy.float16
+QUEUE_ROWS = 1024  # rows buffered for the writer; more are dropped (counted)
+THREAD_TIMEOUT = 5
+
+
+def _layout(width, capacity, itemsize):
+    """[(dtype, shape, offset)] for a chunk's columns, and the file size"""
+    power_dtype = numpy.float16 if itemsize == 2 else numpy.float32
+    layout = list()
+    offset = DATA_OFF
+    for dtype, shape in [(numpy.int64, (capacity,)), (numpy.float64, (capacity,)),
+            (numpy.float64, (capacity,)), (numpy.int32, (capacity,)),
+            (power_dtype, (capacity, width))]:
+        layout.append( (dtype, shape, offset) )
+        offset += numpy.dtype(dtype).itemsize * int(numpy.prod(shape))
+        offset = (offset + 7) & ~7
+
+    return layout, offset
+
+
+def _columns(buf, layout):
+    return [numpy.ndarray(shape, dtype=dtype, buffer=buf, offset=offset) for dtype, shape, offset in layout]
+
+
+class WaterfallWriter(threading.Thread):
+    """Background writer: append() is non-blocking and never stalls a scanner"""
+    def __init__(self, dirname, prefix, compress=False):
+        self.dirname = dirname
+        self.prefix = prefix
+        self.compress = compress
+        self.queue = Queue.Queue(QUEUE_ROWS)
+        self.dropped = 0
+        self.mm = None
+        self.width = 0
+        self.seq = 0  # chunks opened, keeps names unique within a millisecond
+
+        threading.Thread.__init__(self)
+        self.daemon = True
+
+    def append(self, ct, freq_low, step, pwrs):
+        """Queue a row; pwrs must not be modified by the caller afterwards"""
+        try:
+            self.queue.put_nowait( (ct, freq_low, step, pwrs) )
+        except Queue.Full:
+            self.dropped += 1
+
+    def run(self):
+        while True:
+            row = self.queue.get()
+            if row is None:
+                break
+
+            try:
+                self.write(*row)
+            except (IOError, OSError) as e:
+                print("[waterfall] Could not record to {}: {}, stopping recorder".format(self.dirname, e))
+                break
+
+        self.rotate()
+
+    def write(self, ct, freq_low, step, pwrs):
+        if self.mm and len(pwrs) > self.width:  # a wider row than the chunk was sized for
+            self.rotate()
+        if not self.mm:
+            self.open(max(self.width, len(pwrs)))
+
+        row = self.nrows
+        ctcol, freqcol, stepcol, nbinscol, powercol = self.cols
+        ctcol[row] = ct
+        freqcol[row] = freq_low
+        stepcol[row] = step
+        nbins = len(pwrs)
+        nbinscol[row] = nbins
+        powercol[row, :nbins] = pwrs
+        powercol[row, nbins:] = numpy.nan
+
+        self.nrows += 1
+        struct.pack_into('<I', self.mm, NROWS_OFF, self.nrows)
+
+        if self.nrows == CHUNK_ROWS:
+            self.rotate()
+
+    def open(self, width):
+        itemsize = numpy.dtype(POWER_DTYPE).itemsize
+        layout, size = _layout(width, CHUNK_ROWS, itemsize)
+
+        while True:  # O_EXCL: never truncate a chunk, ours or another writer's
+            self.seq += 1
+            self.path = os.path.join(self.dirname, "{}_{}_{:06d}.wf".format(self.prefix, int(time.time() * 1000), self.seq))
+            try:
+                fd = os.open(self.path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o644)
+                break
+            except OSError as e:
+                if e.errno != errno.EEXIST:
+                    raise
+
+        with os.fdopen(fd, 'wb') as f:
+            f.write(HEADER.pack(MAGIC, width, CHUNK_ROWS, 0, itemsize))
+            f.truncate(size)
+        with open(self.path, 'r+b') as f:
+            self.mm = mmap.mmap(f.fileno(), size)
+
+        self.cols = _columns(self.mm, layout)
+        self.width = width
+        self.nrows = 0
+
+    def rotate(self):
+        if not self.mm:
+            return
+
+        del self.cols
+        self.mm.flush()
+        self.mm.close()
+        self.mm = None
+
+        if self.compress:
+            with open(self.path, 'rb') as src:
+                with gzip.open(self.path + '.gz', 'wb') as dst:
+                    shutil.copyfileobj(src, dst)
+            os.unlink(self.path)
+
+    def close(self):
+        try:
+            self.queue.put(None, True, THREAD_TIMEOUT)
+        except Queue.Full:  # writer gave up (see run)
+            return
+        self.join(THREAD_TIMEOUT)
+
+
+def read_waterfall(path):
+    """Yield (ct, freq_low, step, float32 powers) for each row in a chunk"""
+    if path.endswith('.gz'):
+        with gzip.open(path, 'rb') as f:
+            buf = f.read()
+    else:
+        with open(path, 'rb') as f:
+            buf = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+    magic, width, capacity, nrows, itemsize = HEADER.unpack_from(buf, 0)
+    if magic != MAGIC:
+        raise ValueError("{} is not a waterfall file".format(path))
+
+    layout, _ = _layout(width, capacity, itemsize)
+    ctcol, freqcol, stepcol, nbinscol, powercol = _columns(buf, layout)
+    for row in range(nrows):
+        yield (int(ctcol[row]), float(freqcol[row]), float(stepcol[row]),
+                powercol[row, :nbinscol[row]].astype(numpy.float32))